@@ -5,66 +5,104 @@
 # Created by R. Proux, 16/10/2017
 
 import pylab as pl
+import os
+from concurrent.futures import ProcessPoolExecutor
+import scipy.ndimage
 import scipy.signal
 
-def smooth(x,window_len=11,window='hanning'):
+COSMIC_MEMORY_BUDGET = 256 * 2**20  # working memory in bytes allowed for a chunk of frames by filter_cosmic_rays_stack() and filter_cosmic_rays_2d()
+COSMIC_2D_BYTES_PER_PIXEL = 160  # working memory of filter_cosmic_rays_2d() per pixel of a block (float64 intermediate images)
+HISTEQ_MAX_LUT_SIZE = 2**24  # maximum number of levels of integer images equalised with a lookup table by histeq()
+LACOSMIC_MIN_MEDIAN = 1e-4  # floor of the local median used for the noise model of filter_cosmic_rays_2d() (counts)
+LAPLACIAN_KERNEL = pl.array([[0., -1., 0.], [-1., 4., -1.], [0., -1., 0.]])  # used by filter_cosmic_rays_2d()
+SMOOTH_WINDOWS = ('flat', 'hanning', 'hamming', 'bartlett', 'blackman')
+SMOOTH_DIRECT_MAX_WINDOW = 7  # larger windows are convolved with FFT (or a running sum for the flat window) by smooth()
+
+def smooth(x, window_len=11, window='hanning', axis=-1, method='auto'):
     """smooth the data using a window with requested size.
     
     This method is based on the convolution of a scaled window with the signal.
     The signal is prepared by introducing reflected copies of the signal 
     (with the window size) in both ends so that transient parts are minimized
     in the begining and end part of the output signal.
+    N-d arrays are smoothed along axis in one vectorized call (e.g. all the spectra of a SPE map).
 
     Copied and modified from http://scipy-cookbook.readthedocs.io/items/SignalSmooth.html  (16/10/2017 - RProux)
     
     input:
-        x: the input signal 
+        x: the input signal (N-d array)
         window_len: the dimension of the smoothing window; should be an odd integer
         window: the type of window from 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'
             flat window will produce a moving average smoothing.
+        axis: axis of x along which the signal is smoothed
+        method: 'direct' (weighted sum of shifted copies of the signal), 'fft' (scipy.signal.fftconvolve),
+            'uniform' (running sum of scipy.ndimage.uniform_filter1d, flat window only) or 'auto': direct for windows 
+            up to SMOOTH_DIRECT_MAX_WINDOW points, uniform (flat window) or fft for larger ones.
+            All give the same result up to floating point rounding.
 
     output:
-        the smoothed signal
+        the smoothed signal (same shape as x, floating point)
         
     example:
 
     t=linspace(-2,2,0.1)
     x=sin(t)+randn(len(t))*0.1
     y=smooth(x)
+    spectraSmooth=smooth(speMap.data[:, 0, :], 21, axis=1)
     
     see also: 
     
     numpy.hanning, numpy.hamming, numpy.bartlett, numpy.blackman, numpy.convolve
-    scipy.signal.lfilter
+    scipy.signal.lfilter, scipy.signal.fftconvolve
  
     TODO: the window parameter could be the window itself if an array instead of a string
     NOTE: the window_len parameter should always be odd for reliable output (will shift slightly the data if even)
     """
+    x = pl.asarray(x)
+    if x.ndim == 0:
+        raise ValueError("smooth only accepts arrays with at least 1 dimension.")
 
-    if x.ndim != 1:
-        raise ValueError("smooth only accepts 1 dimension arrays.")
-
-    if x.size < window_len:
+    if x.shape[axis] < window_len:
         raise ValueError("Input vector needs to be bigger than window size.")
 
     if window_len < 3:
         return x
 
-    if window not in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']:
+    if window not in SMOOTH_WINDOWS:
         raise ValueError("Window is one of 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'")
 
+    if method == 'auto':
+        if window_len <= SMOOTH_DIRECT_MAX_WINDOW:
+            method = 'direct'
+        else:
+            method = 'uniform' if window == 'flat' else 'fft'
+    if method not in ('direct', 'fft', 'uniform') or (method == 'uniform' and window != 'flat'):
+        raise ValueError("Method is one of 'auto', 'direct', 'fft' or 'uniform' (flat window only)")
 
-    s = pl.r_[x[window_len-1:0:-1],x,x[-2:-window_len-1:-1]]
-    print(s)
-    print(len(s))
+    x = pl.moveaxis(x, axis, -1)
+    length = x.shape[-1]
+    # reflected copies without the edge points, then only the part used by the centered output is kept
+    s = pl.concatenate([x[..., window_len-1:0:-1], x, x[..., -2:-window_len-1:-1]], axis=-1)
+    s = s[..., window_len // 2 : window_len // 2 + length + window_len - 1].astype(pl.result_type(x.dtype, pl.float64))
     if window == 'flat': #moving average
         w = pl.ones(window_len, 'd')
     else:
-        w = eval('pl.{}(window_len)'.format(window))
+        w = getattr(pl, window)(window_len)
+    w = w / w.sum()
 
-    y = pl.convolve(w / w.sum(), s, mode='valid')
+    if method == 'direct':
+        y = w[-1] * s[..., :length]
+        for i in range(1, window_len):
+            y += w[-1 - i] * s[..., i:i + length]
+    elif method == 'fft':
+        y = scipy.signal.fftconvolve(s, w.reshape((1,) * (s.ndim - 1) + (window_len,)), mode='valid', axes=-1)
+    else:
+        # moving average of the window_len points from each point, computed as a running sum on the signal minus its mean
+        # (the rounding errors stay relative to the variations of the signal, not to its offset)
+        offset = s.mean(axis=-1, keepdims=True)
+        y = scipy.ndimage.uniform_filter1d(s - offset, window_len, axis=-1)[..., window_len // 2 : window_len // 2 + length] + offset
 
-    return y[int(pl.floor(window_len/2)) : -int(pl.ceil(window_len/2) - 1)]
+    return pl.moveaxis(y, -1, axis)
 
 
 def filter_cosmic_rays(spectrum, error_thr=10., filter_size=5):
@@ -88,6 +126,184 @@ def filter_cosmic_rays(spectrum, error_thr=10., filter_size=5):
     
     return spectrum_corr
 
+
+
+def filter_cosmic_rays_stack(frames, error_thr=10., nb_neighbours=2, filter_size=5, memory_budget=COSMIC_MEMORY_BUDGET):
+    """
+    Filters out cosmic rays from a stack of frames (e.g. all the spectra of a SPE map) in one vectorized call.
+    Each frame is compared to the median of itself and its nb_neighbours previous and next frames (temporal median,
+    mirrored at the ends of the stack): a cosmic ray hits a single frame while a real spectral line is present in
+    the neighbouring frames too. Stacks of less than 3 frames cannot use a temporal median and are compared to
+    a spatial median (filter_size pixels along each pixel axis) instead, like filter_cosmic_rays().
+    Only pixels above the median are flagged (cosmic rays add counts) and they are replaced by the median.
+    The stack is processed by chunks of frames, so frames can be a memory map of a large file.
+    
+    Args:
+        frames (numpy array): stack of frames, frames x pixels or frames x y x x (e.g. data of a SPE3map)
+        error_thr (float, optional): spike detection threshold. Pixels exceeding the median by more than error_thr
+        are flagged as cosmic rays.
+        nb_neighbours (int, optional): number of frames on each side of a frame used for the temporal median.
+        filter_size (int, optional): number of pixels of the spatial median window (stacks of less than 3 frames).
+        memory_budget (int, optional): working memory allowed for a chunk of frames, in bytes.
+    
+    Returns:
+        numpy array: the frames corrected (cosmic rays removed), same shape and type as frames.
+        numpy array: boolean mask of the pixels flagged as cosmic rays (same shape as frames).
+    """
+    nb_of_frames = frames.shape[0]
+    corrected = pl.empty(frames.shape, frames.dtype)
+    mask = pl.empty(frames.shape, bool)
+    if nb_of_frames < 3:
+        # spatial median (axes of length 1 are not filtered)
+        size = (1,) + tuple(filter_size if length > 1 else 1 for length in frames.shape[1:])
+        margin = 0
+    else:
+        size = (2 * nb_neighbours + 1,) + (1,) * (frames.ndim - 1)
+        margin = nb_neighbours
+    frame_nbytes = int(pl.prod(frames.shape[1:])) * (2 * frames.dtype.itemsize + 8 + 1)
+    chunk_length = max(1, int(memory_budget // frame_nbytes) - 2 * margin)
+
+    for chunk_start in range(0, nb_of_frames, chunk_length):
+        chunk_stop = min(chunk_start + chunk_length, nb_of_frames)
+        # the chunk is read with margin frames on each side so that the temporal median does not depend on the chunking
+        read_start, read_stop = max(0, chunk_start - margin), min(nb_of_frames, chunk_stop + margin)
+        chunk = pl.asarray(frames[read_start:read_stop])
+        median = scipy.ndimage.median_filter(chunk, size=size, mode='mirror')
+        # the mirrored boundary only matters at the ends of the stack, the margins are dropped
+        kept = slice(chunk_start - read_start, chunk_stop - read_start)
+        chunk, median = chunk[kept], median[kept]
+        chunk_mask = chunk.astype(pl.float64) - median > float(error_thr)
+        mask[chunk_start:chunk_stop] = chunk_mask
+        corrected[chunk_start:chunk_stop] = pl.where(chunk_mask, median, chunk)
+
+    return corrected, mask
+
+
+def _median_2d(images, size, separable=False):
+    """Median filter of size x size pixels applied to each image of a stack (last two axes), mirrored at the edges.
+    If separable, median along x then along y (much faster, very close to the 2D median for smooth structures)."""
+    leading = (1,) * (images.ndim - 2)
+    if separable:
+        return scipy.ndimage.median_filter(scipy.ndimage.median_filter(images, size=leading + (1, size), mode='mirror'),
+                                           size=leading + (size, 1), mode='mirror')
+    return scipy.ndimage.median_filter(images, size=leading + (size, size), mode='mirror')
+
+
+def _masked_median_2d(images, mask, size=5):
+    """Median of the unmasked pixels in a size x size window around each masked pixel of a stack of images.
+    Returns the medians in the order of pl.nonzero(mask) (median of all the pixels of the window if all are masked)."""
+    half = size // 2
+    padding = [(0, 0)] * (images.ndim - 2) + [(half, half)] * 2
+    padded_images, padded_mask = pl.pad(images, padding, mode='reflect'), pl.pad(mask, padding, mode='reflect')
+    indices = pl.nonzero(mask)
+    window = [indices[:-2] + (indices[-2] + half + dy, indices[-1] + half + dx)
+              for dy in range(-half, half + 1) for dx in range(-half, half + 1)]
+    values = pl.stack([padded_images[pixels] for pixels in window], axis=-1)
+    masked = pl.stack([padded_mask[pixels] for pixels in window], axis=-1)
+    masked[masked.all(axis=-1)] = False
+    return pl.nanmedian(pl.where(masked, pl.nan, values), axis=-1)
+
+
+def _filter_cosmic_rays_2d_chunk(frames, sigclip, sigfrac, objlim, gain, read_noise, max_iter, separable_median):
+    """Laplacian cosmic ray rejection on a block of raw frames (frames x y x x), see filter_cosmic_rays_2d().
+    Returns the cleaned frames (same type as frames) and the mask."""
+    images = pl.asarray(frames, dtype=pl.float64)
+    kernel = LAPLACIAN_KERNEL.reshape((1,) * (images.ndim - 2) + (3, 3))
+    growth = pl.ones((1,) * (images.ndim - 2) + (3, 3), bool)
+    mask = pl.zeros(images.shape, bool)
+    cleaned = images.copy()
+    for _ in range(max_iter):
+        # Laplacian of the image subsampled 2x2 (the edges of the cosmic rays stay sharp), negative values are clipped
+        subsampled = pl.repeat(pl.repeat(cleaned, 2, axis=-2), 2, axis=-1)
+        laplacian = pl.clip(scipy.ndimage.convolve(subsampled, kernel, mode='mirror'), 0, None)
+        laplacian = laplacian.reshape(laplacian.shape[:-2] + (cleaned.shape[-2], 2, cleaned.shape[-1], 2)).mean(axis=(-3, -1))
+
+        # significance of the Laplacian in units of the noise (Poisson and read noise), large structures removed
+        median5 = _median_2d(cleaned, 5, separable_median)
+        # (median clipped to a small positive floor as in L.A.Cosmic, so that the noise is never 0)
+        noise = pl.sqrt(gain * pl.clip(median5, LACOSMIC_MIN_MEDIAN, None) + read_noise**2) / gain
+        significance = laplacian / (2 * noise)
+        significance -= _median_2d(significance, 5, separable_median)
+
+        # candidates: significant and sharper than the fine structure of the image (stars, lines, peaks)
+        median3 = _median_2d(cleaned, 3, separable_median)
+        fine_structure = pl.clip(median3 - _median_2d(median3, 7, separable_median), 0.01, None)
+        candidates = (significance > sigclip) & (laplacian / fine_structure > objlim)
+
+        # neighbouring pixels of the candidates: significant ones, then the less significant ones around them
+        candidates = scipy.ndimage.binary_dilation(candidates, growth) & (significance > sigclip)
+        candidates = scipy.ndimage.binary_dilation(candidates, growth) & (significance > sigfrac * sigclip)
+
+        new_cosmics = candidates & ~mask
+        if not new_cosmics.any():
+            break
+        mask |= new_cosmics
+        cleaned[mask] = _masked_median_2d(images, mask)
+    if pl.issubdtype(frames.dtype, pl.integer):
+        cleaned = pl.rint(cleaned)
+    return cleaned.astype(frames.dtype), mask
+
+
+def filter_cosmic_rays_2d(images, sigclip=4.5, sigfrac=0.3, objlim=5., gain=1., read_noise=6.5, max_iter=4,
+                          separable_median=True, workers=1, memory_budget=COSMIC_MEMORY_BUDGET):
+    """
+    Filters out cosmic rays from 2D CCD images (imaging mode SPE frames, FITS or TIFF images, see 
+    instruments/readFits.py) by Laplacian edge detection (L.A.Cosmic algorithm, P. G. van Dokkum, PASP 113, 1420, 2001).
+    Cosmic rays have sharper edges than any real feature blurred by the optics: the Laplacian of the image
+    subsampled 2x2 is compared to the noise and to the fine structure of the image, the detected pixels
+    are replaced by the median of their good neighbours and the detection is iterated.
+    Stacks of images are processed by blocks of frames (scipy.ndimage kernels over the last two axes) sized by
+    memory_budget, so images can be a memory map of a large file, and the blocks can be split between a pool of processes.
+    The noise model assumes raw counts: the images must not be background-subtracted (a zero or negative
+    background gives a noise close to the read noise only, and many pixels are flagged).
+    
+    Args:
+        images (numpy array): a 2D image (y x x) or a stack of images (frames x y x x, or more leading axes)
+        sigclip (float, optional): detection threshold of the Laplacian, in units of the noise.
+        sigfrac (float, optional): detection threshold of the pixels neighbouring a cosmic ray, as a fraction of sigclip.
+        objlim (float, optional): minimum contrast between the Laplacian and the fine structure of the image
+        (increase it if real sharp features are flagged).
+        gain (float, optional): gain of the camera in electrons per count (for the Poisson noise).
+        read_noise (float, optional): read noise of the camera, in electrons.
+        max_iter (int, optional): maximum number of detection iterations.
+        separable_median (bool, optional): use separable median filters (median along x then along y, several times
+        faster than the 2D medians with almost identical detections).
+        workers (int, optional): number of processes among which the blocks of frames are split (1: no pool, 
+        None: number of processors).
+        memory_budget (int, optional): working memory allowed for the blocks being processed (all workers), in bytes.
+    
+    Returns:
+        numpy array: the images corrected (cosmic rays removed), same shape and type as images.
+        numpy array: boolean mask of the pixels flagged as cosmic rays (same shape as images).
+    """
+    images = pl.asarray(images)
+    if images.ndim < 2:
+        raise ValueError("filter_cosmic_rays_2d only accepts images or stacks of images (at least 2 dimensions).")
+    stack = images.reshape((-1,) + images.shape[-2:])
+    cleaned = pl.empty(stack.shape, images.dtype)
+    mask = pl.empty(stack.shape, bool)
+    options = (sigclip, sigfrac, objlim, gain, read_noise, max_iter, separable_median)
+    workers = os.cpu_count() if workers is None else workers
+    # the budget is shared by the blocks processed at the same time (one per worker)
+    block_length = max(1, int(memory_budget // (max(1, workers) * COSMIC_2D_BYTES_PER_PIXEL * pl.prod(stack.shape[1:]))))
+    block_starts = range(0, len(stack), block_length)
+
+    if workers > 1 and len(block_starts) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # blocks of raw frames are read and sent as the results come back (at most 2 blocks per worker in flight)
+            pending = []
+            for block_start in block_starts:
+                block = pl.asarray(stack[block_start:block_start + block_length])
+                pending.append((block_start, executor.submit(_filter_cosmic_rays_2d_chunk, block, *options)))
+                while pending and (len(pending) >= 2 * workers or block_start == block_starts[-1]):
+                    done_start, future = pending.pop(0)
+                    cleaned[done_start:done_start + block_length], mask[done_start:done_start + block_length] = future.result()
+    else:
+        for block_start in block_starts:
+            cleaned[block_start:block_start + block_length], mask[block_start:block_start + block_length] = \
+                _filter_cosmic_rays_2d_chunk(pl.asarray(stack[block_start:block_start + block_length]), *options)
+
+    return cleaned.reshape(images.shape), mask.reshape(images.shape)
     
 def range_to_edge(middles):
     """Converts from a list of values to list of boundaries
@@ -101,12 +317,19 @@ def range_to_edge(middles):
     
     Returns:
         numpy array: list of edges (has len(middles)+1 elements)
+    
+    Raises:
+        ValueError: if middles has less than 2 elements (the interval is unknown)
     """
-    edges = [(float(leftMiddle) + rightMiddle) / 2 for leftMiddle, rightMiddle in zip(middles[1:], middles[:-1])]
-    edges.insert(0, float(middles[0]) - (edges[0] - middles[0]))
-    edges.append(float(middles[-1]) + (middles[-1] - edges[-1]))
+    middles = pl.asarray(middles, dtype=pl.float64)
+    if len(middles) < 2:
+        raise ValueError("range_to_edge needs at least 2 values to deduce the edges.")
+    edges = pl.empty(len(middles) + 1)
+    edges[1:-1] = (middles[1:] + middles[:-1]) / 2
+    edges[0] = middles[0] - (edges[1] - middles[0])
+    edges[-1] = middles[-1] + (middles[-1] - edges[-2])
     
-    return pl.array(edges)
+    return edges
 
 
 def crop_array(array, top, right, bottom, left):
@@ -125,23 +348,69 @@ def crop_array(array, top, right, bottom, left):
     return array[top:-bottom, left:-right]
 
 
-def histeq(im, nb_bins=256):
+def _histeq_cdf(im, nb_bins):
+    """Cumulative distribution function of the histogram of im (nb_bins bins between its min and max), normalized to 65535.
+    Integer images with less than HISTEQ_MAX_LUT_SIZE levels are counted level by level with bincount (the histogram is
+    then computed on the levels, which gives the same bins as on the pixels).
+    Returns the left edges of the bins, the cdf, the lowest level and the pixel levels relative to it 
+    (None if the image is not counted level by level)."""
+    low, high = im.min(), im.max()
+    if pl.issubdtype(im.dtype, pl.integer) and int(high) - int(low) < HISTEQ_MAX_LUT_SIZE:
+        if pl.issubdtype(im.dtype, pl.unsignedinteger):
+            levels = (im.ravel() - low).astype(pl.intp)  # no overflow: subtracted in the unsigned type
+        else:
+            levels = im.ravel().astype(pl.int64) - int(low)
+        low, high = int(low), int(high)
+        counts = pl.bincount(levels, minlength=high - low + 1)  # sized by the range of the levels, not by their values
+        imhist, bins = pl.histogram(pl.arange(low, high + 1), nb_bins, range=(low, high), weights=counts)
+    else:
+        imhist, bins = pl.histogram(im.ravel(), nb_bins)
+        low = levels = None
+    cdf = imhist.cumsum() #cumulative distribution function
+    cdf = 65535 * cdf / cdf[-1] #normalize
+    return bins[:-1], cdf, low, levels
+
+
+def _histeq_image(im, nb_bins, out):
+    """Equalises the histogram of im (image or stack, one histogram for all the pixels) and writes the result in out."""
+    bins, cdf, low, levels = _histeq_cdf(im, nb_bins)
+    if levels is None:
+        # use linear interpolation of cdf to find new pixel values
+        out[...] = pl.interp(im.ravel(), bins, cdf).reshape(im.shape)
+        return
+    # lookup table of the new value of each level (indexed from the lowest level), applied without interpolation
+    lut = pl.interp(pl.arange(low, low + levels.max() + 1), bins, cdf)
+    if pl.issubdtype(out.dtype, pl.integer):
+        lut = pl.rint(lut)
+    out[...] = pl.take(lut.astype(out.dtype), levels).reshape(im.shape)
+
+
+def histeq(im, nb_bins=256, per_frame=False, out=None):
     """
     This function equalises the histogram of im (numpy array), distributing
     the pixels accross nbr_bins bins.
     Returns the equalised image as a numpy array (same shape as input).
     Largely copied from https://stackoverflow.com/a/28520445  
         (author: Trilarion, 17/07/2017)
+    
+    Stacks of images (frames x y x x, or more leading axes) are equalised with the histogram of the whole stack
+    (per_frame=False) or frame by frame (per_frame=True). Integer images (e.g. uint16 camera frames) are counted with
+    bincount and mapped through a lookup table of the levels, which is much faster than the interpolation of each pixel.
+    The result can be written in a preallocated array out (any numeric type, values are rounded for integer types).
     """
-    # get image histogram
-    imhist, bins = pl.histogram(im.flatten(), nb_bins, normed=True)
-    cdf = imhist.cumsum() #cumulative distribution function
-    cdf = 65535 * cdf / cdf[-1] #normalize
+    im = pl.asarray(im)
+    if out is None:
+        out = pl.empty(im.shape, pl.float64)
+    elif out.shape != im.shape:
+        raise ValueError("out must have the same shape as im.")
     
-    # use linear interpolation of cdf to find new pixel values
-    im2 = pl.interp(im.flatten(), bins[:-1], cdf)
+    if per_frame and im.ndim > 2:
+        for index in pl.ndindex(im.shape[:-2]):
+            _histeq_image(im[index], nb_bins, out[index])
+    else:
+        _histeq_image(im, nb_bins, out)
     
-    return im2.reshape(im.shape)
+    return out
 
 
 if __name__ == '__main__':
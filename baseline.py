@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file contains baseline (background) estimation functions for spectra and stacks of spectra (e.g. SPE maps):
+# asymmetric least squares, rolling ball and percentile filter baselines, and their batched application over
+# chunks of spectra in a pool of processes (estimate_baseline).
+# All functions work along the last axis (pixels) of arrays of any shape (frames x pixels, frames x y x pixels, etc.).
+#
+# Example (background of every spectrum of a map):
+#     spe = SPE3map('map.spe', memmap=True)
+#     corrected = spe.data - estimate_baseline(spe.data, 'als', workers=None, lam=1e6)
+#
+# Created on 18/10/2026
+
+import numpy as np
+import os
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import scipy.linalg
+import scipy.ndimage
+
+BASELINE_CHUNK_LENGTH = 256  # number of spectra per task of estimate_baseline()
+
+
+@functools.lru_cache(maxsize=8)
+def _als_penalty(nb_of_pixels, lam):
+    """Smoothness penalty lam * D'D of the asymmetric least squares (D: second difference matrix), in the upper banded
+    form of scipy.linalg.solveh_banded (rows: second superdiagonal, first superdiagonal, diagonal).
+    Built once for each number of pixels and lam (read-only, copy it to add the weights to the diagonal)."""
+    penalty = np.zeros((3, nb_of_pixels))
+    if nb_of_pixels < 5:
+        # D'D computed explicitly for very short spectra (the edge values below overlap, no penalty under 3 pixels)
+        difference = np.diff(np.eye(nb_of_pixels), 2, axis=0)
+        full = difference.T @ difference
+        for offset in range(min(3, nb_of_pixels)):
+            penalty[2 - offset, offset:] = np.diagonal(full, offset)
+    else:
+        penalty[0, 2:] = 1
+        penalty[1, 1:] = -4
+        penalty[1, 1] = penalty[1, -1] = -2
+        penalty[2, :] = 6
+        penalty[2, 0] = penalty[2, -1] = 1
+        penalty[2, 1] = penalty[2, -2] = 5
+    penalty *= lam
+    penalty.flags.writeable = False
+    return penalty
+
+
+def als_baseline(spectra, lam=1e5, p=0.01, max_iter=10):
+    """Asymmetric least squares baseline (P. Eilers and H. Boelens, 2005): smooth curve z minimizing
+    sum(w * (y - z)**2) + lam * sum(diff(z, 2)**2), where the weights w are p above the curve (peaks) and 1 - p below.
+    The weights are updated until they do not change (or max_iter iterations).
+    The penalty matrix depends only on the number of pixels and lam, it is built once and reused for every spectrum;
+    each weighted system is pentadiagonal and solved in linear time by banded Cholesky decomposition.
+
+    Args:
+        spectra (numpy array): spectrum or array of spectra along the last axis
+        lam (float, optional): smoothness (1e2 to 1e9, larger values give smoother baselines)
+        p (float, optional): asymmetry, weight of the points above the baseline (0.001 to 0.1)
+        max_iter (int, optional): maximum number of weight updates
+
+    Returns:
+        numpy array: baselines (same shape as spectra, float)
+    """
+    spectra = np.asarray(spectra, dtype=np.float64)
+    nb_of_pixels = spectra.shape[-1]
+    penalty = _als_penalty(nb_of_pixels, float(lam))
+    baselines = np.empty(spectra.shape)
+    for index in np.ndindex(spectra.shape[:-1]):
+        spectrum = spectra[index]
+        weights = np.ones(nb_of_pixels)
+        for _ in range(max_iter):
+            system = penalty.copy()
+            system[-1] += weights
+            baseline = scipy.linalg.solveh_banded(system, weights * spectrum, check_finite=False)
+            new_weights = np.where(spectrum > baseline, p, 1 - p)
+            if np.array_equal(new_weights, weights):
+                break
+            weights = new_weights
+        baselines[index] = baseline
+    return baselines
+
+
+def rolling_ball_baseline(spectra, radius=50, ball_height=0.):
+    """Rolling ball baseline: the ball (half-width radius pixels) is rolled under the spectra and the baseline is the
+    top of the region it can reach (grey opening of the spectra by the ball profile).
+
+    Args:
+        spectra (numpy array): spectrum or array of spectra along the last axis
+        radius (int, optional): half-width of the ball in pixels, larger than the half-width of the peaks
+        ball_height (float, optional): height of the ball in counts (0 for a flat structuring element, which follows
+                                       the minimum of the spectra over 2 * radius + 1 pixels)
+
+    Returns:
+        numpy array: baselines (same shape as spectra, float)
+    """
+    spectra = np.asarray(spectra, dtype=np.float64)
+    position = np.arange(-radius, radius + 1) / (radius + 1.)
+    profile = ball_height * (np.sqrt(1 - position**2) - 1)
+    return scipy.ndimage.grey_opening(spectra, structure=profile.reshape((1,) * (spectra.ndim - 1) + (-1,)),
+                                      mode='nearest')
+
+
+def percentile_baseline(spectra, window=101, percentile=10., smoothing=None):
+    """Percentile filter baseline: percentile of the spectra in a sliding window, optionally smoothed
+    (moving average of smoothing pixels) to remove the steps of the filter.
+
+    Args:
+        spectra (numpy array): spectrum or array of spectra along the last axis
+        window (int, optional): size of the sliding window in pixels, larger than the width of the peaks
+        percentile (float, optional): percentile (0 to 100) of the pixels in the window taken as baseline
+        smoothing (int, optional): size of the moving average applied to the baseline (no smoothing if None)
+
+    Returns:
+        numpy array: baselines (same shape as spectra, float)
+    """
+    spectra = np.asarray(spectra, dtype=np.float64)
+    size = (1,) * (spectra.ndim - 1) + (window,)
+    baselines = scipy.ndimage.percentile_filter(spectra, percentile, size=size, mode='nearest')
+    if smoothing is not None:
+        baselines = scipy.ndimage.uniform_filter1d(baselines, smoothing, axis=-1, mode='nearest')
+    return baselines
+
+
+BASELINE_METHODS = {'als': als_baseline, 'rolling_ball': rolling_ball_baseline, 'percentile': percentile_baseline}
+
+
+def _baseline_chunk(method, spectra, options):
+    """Baselines of a chunk of spectra (task of estimate_baseline())."""
+    return BASELINE_METHODS[method](spectra, **options)
+
+
+def estimate_baseline(spectra, method='als', workers=1, chunk_length=BASELINE_CHUNK_LENGTH, **options):
+    """Baselines of a stack of spectra (e.g. data of a SPE map, can be a memory map), computed by chunks of spectra
+    which are distributed between a pool of processes.
+
+    Args:
+        spectra (numpy array): array of spectra along the last axis (frames x pixels, frames x y x pixels, etc.)
+        method (str, optional): 'als' (als_baseline), 'rolling_ball' (rolling_ball_baseline)
+                                or 'percentile' (percentile_baseline)
+        workers (int, optional): number of processes (1: no pool, None: number of processors)
+        chunk_length (int, optional): number of spectra per chunk
+        **options: parameters of the baseline function (e.g. lam and p for 'als')
+
+    Returns:
+        numpy array: baselines (same shape as spectra, float)
+
+    Raises:
+        ValueError: if the method is unknown
+    """
+    if method not in BASELINE_METHODS:
+        raise ValueError('Unknown baseline method {!r} (available: {}).'.format(method, ', '.join(BASELINE_METHODS)))
+    stack = spectra.reshape((-1, spectra.shape[-1]))
+    baselines = np.empty(stack.shape)
+    chunk_starts = range(0, len(stack), chunk_length)
+    workers = os.cpu_count() if workers is None else workers
+
+    if workers > 1 and len(chunk_starts) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = (np.asarray(stack[start:start + chunk_length]) for start in chunk_starts)
+            results = executor.map(_baseline_chunk, [method] * len(chunk_starts), chunks, [options] * len(chunk_starts))
+            for start, result in zip(chunk_starts, results):
+                baselines[start:start + chunk_length] = result
+    else:
+        for start in chunk_starts:
+            baselines[start:start + chunk_length] = _baseline_chunk(method, np.asarray(stack[start:start + chunk_length]), options)
+
+    return baselines.reshape(spectra.shape)
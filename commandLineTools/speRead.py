@@ -6,32 +6,83 @@
 # Used code from jabaldonedo 19/01/2018
 #    https://stackoverflow.com/questions/18390461/scroll-backwards-and-forwards-through-matplotlib-plots
 
-import matplotlib
-matplotlib.use('Qt5Agg')
-import pylab as pl
+import numpy as np
 import click
+import glob
 import os
-import tools.instruments.princeton3.SPE2read as spe2
-import tools.instruments.princeton3.SPE3read as spe3
+import threading
+from tools.instruments.princeton3.SPEread import openSPE
+from tools.instruments.princeton3.SPEexport import exportFrames, parseFrameSelection
+
+
+def new_figure(headless=False):
+    """Creates a figure, importing the plotting stack only at this point: exports do not load it
+    and work on machines without display.
+    
+    Args:
+        headless (bool, optional): if True, the figure is rendered with the Agg backend (to files only, no display needed
+                                   and not managed by pyplot), otherwise it is a pyplot figure using Qt5Agg (window)
+    
+    Returns:
+        tuple: matplotlib figure, matplotlib.pyplot module (None if headless)
+    """
+    if headless:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        return fig, None
+    import matplotlib
+    matplotlib.use('Qt5Agg')
+    import matplotlib.pyplot as plt
+    return plt.figure(), plt
 
 
 @click.command()
-@click.argument('filename', nargs=1, required=True, type=click.Path(exists=True))
-@click.option('--export', '-o', type=click.Path(exists=False, writable=True), nargs=1, help="export as text file to this path.")
+@click.argument('filenames', nargs=-1, required=True, type=click.Path())
+@click.option('--export', '-o', type=click.Path(exists=False, writable=True), nargs=1, help="export as text file to this path (single file only).")
 @click.option('--autoexport', '-a', is_flag=True, help="export as text file with automatic name (name of original file + frame number).")
+@click.option('--png', '-p', is_flag=True, help="render the spectra to PNG files without display (name of original file + frame number), "
+                                                "the frame given by --index or the frames given by --frames.")
 @click.option('--index', '-i', type=click.INT, nargs=1, default=0, help="index of spectrum to export or to display first.")
-def spe_read(filename, index=0, export=None, autoexport=False):
+@click.option('--frames', '-f', type=click.STRING, nargs=1, help="frames to export in one pass: index, start:stop:step (e.g. 0::10) or all. "
+                                                                 "The format is given by the export extension: .csv, .tsv, .txt, .npy, .npz or .hdf5.")
+@click.option('--map', '-m', 'map_view', is_flag=True, help="show all the frames as a map (frames x wavelength), click on a row to plot its spectrum. "
+                                                            "With --png, renders the map to a PNG file (name of original file + -map).")
+@click.option('--aggregation', type=click.Choice(['max', 'min', 'mean']), default='max', help="how pixels are merged when the map is larger than the screen.")
+def spe_read(filenames, index=0, export=None, autoexport=False, png=False, frames=None, map_view=False, aggregation='max'):
     """
-    Reads, plots and exports an SPE2 or SPE3 file from Princeton Instruments (WinSpec and Lightfield).
+    Reads, plots and exports SPE2 or SPE3 files from Princeton Instruments (WinSpec and Lightfield).
     Handles multiple frames by using left and right arrows (try combining with alt and windows/cmd/super/ctrl to change scrolling speed).
+    Several files (or patterns with *) are processed one after the other in the same process.
     """
-    if autoexport:
+    filenames = [filename for pattern in filenames
+                 for filename in ([pattern] if os.path.exists(pattern) else sorted(glob.glob(pattern)))]
+    if not filenames:
+        raise click.BadParameter('no file matches the given filenames.', param_hint='FILENAMES')
+    if export is not None and len(filenames) > 1:
+        raise click.UsageError('--export takes a single file, use --autoexport for several files.')
+    if frames is not None and export is None and not autoexport and not png:
+        raise click.UsageError('--frames needs --export, --autoexport or --png.')
+    for filename in filenames:
         filename_noext, _ = os.path.splitext(filename)
-        export = '{}-frame{}.txt'.format(filename_noext, index)
-    spectrum = SpeRead(filename, start_index=index, export=export)
+        if autoexport:
+            if frames is None:
+                export = '{}-frame{}.txt'.format(filename_noext, index)
+            else:
+                export = '{}-frames.txt'.format(filename_noext)
+        if map_view:
+            SpeMap(filename, aggregation=aggregation, png=filename_noext + '-map.png' if png else None)
+            continue
+        png_pattern = filename_noext + '-frame{}.png' if png else None
+        SpeRead(filename, start_index=index, export=export, frames=frames, png=png_pattern)
 
 class SpeRead():
-    def __init__(self, filename, start_index=0, export=None, autoexport=False):
+
+    PREFETCH_STEPS = (1, -1, 2, -2, 25, -25, 250, -250, 3, -3, 4, -4)  # frames prefetched around the displayed frame
+    RESCALE_FILL = 0.25  # the y axis is rescaled when the spectrum fills less than this fraction of its height
+
+    def __init__(self, filename, start_index=0, export=None, autoexport=False, frames=None, png=None, block=True):
         """Object used to read SPE files, plot them and export them to a text file
         
         Args:
@@ -39,58 +90,212 @@ class SpeRead():
             start_index (int, optional): index of the frame you want to export or the plot to start.
             export (str, optional): path to the exported text file. If None, will plot the spectra, if not None, will export.
             autoexport (bool, optional): if True, will export with an automated 'filename + frame number' named text file.
+            frames (str, optional): frames to export in one pass (see SPEexport.parseFrameSelection()), to a file 
+                                    whose format is given by the extension of export (see SPEexport.exportFrames()).
+                                    If None, only the start_index frame is exported.
+                                    With png, frames to render (only the start_index frame if None).
+            png (str, optional): if not None, renders the spectra to PNG files (without display) instead of plotting them,
+                                 png is the path of the files with {} for the frame index (e.g. 'spectrum-frame{}.png').
+            block (bool, optional): if False, the plot window is shown without blocking (e.g. when opened from a SpeMap window).
         """
-        self.data = self.open_spe(filename)
+        if png is not None:
+            self.data = self.open_spe(filename, memmap=True)
+            if frames is None:
+                start_index = self.frame_index(start_index)
+                frame_indices = range(start_index, start_index + 1)
+            else:
+                frame_indices = parseFrameSelection(frames, self.data.nbOfFrames)
+            self.init_plot(frame_indices[0], headless=True)
+            self.save_png(frame_indices, png)
 
-        self.curr_pos = start_index
+        if export is None and png is None:
+            self.data = self.open_spe(filename, memmap=True)
+            self.init_plot(self.frame_index(start_index), block=block)
+        elif export is not None and frames is not None:
+            self.data = self.open_spe(filename, memmap=True)
+            exportFrames(self.data, export, frames=frames)
+        elif export is not None:
+            self.data = self.open_spe(filename, headerOnly=True)
+            index = self.frame_index(start_index)
+            spectrum = self.data.readFrames(index, index + 1)[0][0]
+            save_array = np.array([self.data.wavelength, spectrum]).transpose()
+            np.savetxt(export, save_array)
 
-        if export is None:
-            self.init_plot(start_index)
-        else:
-            save_array = pl.array([self.data.wavelength, self.data.data[start_index][0]]).transpose()
-            pl.savetxt(export, save_array)
-
-    def open_spe(self, filename):
-        """Opens the SPE file as an SPE3map or SPE2map (automatic selection) from the corresponding libraries.
+    def open_spe(self, filename, **options):
+        """Opens the SPE file as an SPE3map or SPE2map (automatic selection based on the SPE version, see SPEread.openSPE()).
         
         Args:
             filename (str): path to the SPE file to open
+            **options: options to pass to openSPE (memmap, headerOnly)
         
         Returns:
             SPE3map or SPE2map object: object to handle the file (access to wavelength vector, different frames, etc.)
         """
+        return openSPE(filename, **options)
+
+    def frame_index(self, index):
+        """Checks a frame index given on the command line against the opened file, negative indices counting from the end.
+        
+        Args:
+            index (int): frame index (-1 for the last frame)
+        
+        Returns:
+            int: frame index between 0 and nbOfFrames - 1
+        
+        Raises:
+            click.BadParameter: if the index is out of the frames of the file
+        """
         try:
-            data = spe3.SPE3map(filename)
-        except:
-            data = spe2.SPE2map(filename)
+            return range(self.data.nbOfFrames)[index]
+        except IndexError:
+            raise click.BadParameter('frame {} out of the {} frames of the file.'.format(index, self.data.nbOfFrames),
+                                     param_hint='--index')
+
+    def get_frame(self, index):
+        """Returns the spectrum (first row of the frame, first region of interest) of a frame, from the prefetch cache
+        if it is there (see prefetch()), otherwise read from the file.
+        
+        Args:
+            index (int): frame index
+        
+        Returns:
+            numpy array: spectrum of the frame
+        """
+        spectrum = self._frame_cache.get(index)
+        if spectrum is None:
+            frames = self.data.readFrames(index, index + 1)
+            if type(frames) == dict:
+                frames = next(iter(frames.values()))
+            spectrum = frames[0][0]
+        return spectrum
 
-        return data
+    def prefetch(self, index):
+        """Reads in a background thread the frames around index which can be reached with one key press 
+        (see key_event()), so that they are in memory when they are requested. The cache only keeps these frames.
+        
+        Args:
+            index (int): frame index currently displayed
+        """
+        with self._prefetch_lock:
+            self._prefetch_index = index
+            if self._prefetch_thread is not None and self._prefetch_thread.is_alive():
+                return  # the running thread will pick up the new index
+            self._prefetch_thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+            self._prefetch_thread.start()
 
-    def init_plot(self, start_index):
+    def _prefetch_loop(self):
+        """Fills the frame cache around the last index given to prefetch() (executed in the prefetch thread)."""
+        while True:
+            with self._prefetch_lock:
+                index = self._prefetch_index
+                self._prefetch_index = None
+                if index is None:
+                    return
+            wanted = [(index + step) % self.data.nbOfFrames for step in self.PREFETCH_STEPS]
+            cache = {i: self._frame_cache[i] for i in wanted if i in self._frame_cache}
+            for i in wanted:
+                if self._prefetch_index is not None:
+                    break  # a new index was requested, restart around it
+                if i not in cache:
+                    cache[i] = self.get_frame(i)
+                    self._frame_cache[i] = cache[i]
+            self._frame_cache = cache
+
+    def init_plot(self, start_index, headless=False, block=True):
         """First plot, to call before plot_spe() which is meant to update the plot only.
         Note it will make the first call for plot_spe() so plot_spe() can be called by the user to then update the plot.
+        The spectrum line and the title are animated artists: they are blitted over a cached background 
+        (axes, ticks and labels) which is only redrawn when the scale of the plot changes.
         
         Args:
             start_index (int): frame index for the first plot
+            headless (bool, optional): if True, only prepares the figure with the Agg backend (see save_png()),
+                                       no window is shown
+            block (bool, optional): if False, shows the window without blocking (the event loop is already running)
         """
-        self.fig = pl.figure()
+        self.curr_pos = start_index
+        self._frame_cache = {}
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_index = None
+        self._prefetch_thread = None
+        self._background = None
+
+        self.fig, plt = new_figure(headless)
         self.fig.canvas.mpl_connect('key_press_event', self.key_event)
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
         self.ax = self.fig.add_subplot(111)
-        self.plot_spe(start_index)
-        pl.show()
+        self.line, = self.ax.plot(self.data.wavelength, self.get_frame(start_index), animated=True)
+        self.ax.title.set_animated(True)
+        self.ax.set_xlabel('Wavelength (nm)')
+        self.ax.set_ylabel('Intensity (counts/{:.3f} ms)'.format(self.data.exposureTime))
+        if not headless:
+            self.plot_spe(start_index)
+            if block:
+                plt.show()
+            else:
+                self.fig.show()
+
+    def save_png(self, frame_indices, png):
+        """Renders the spectra of frames to PNG files, reusing the headless figure prepared by init_plot().
+        
+        Args:
+            frame_indices (iterable): indices of the frames to render
+            png (str): path of the files with {} for the frame index (e.g. 'spectrum-frame{}.png')
+        """
+        for index in frame_indices:
+            self.line.set_ydata(self.get_frame(index))
+            self.ax.set_title('Spectrum {}/{}'.format(index + 1, self.data.nbOfFrames))
+            self.ax.relim()
+            self.ax.autoscale_view(scalex=False)
+            self.fig.savefig(png.format(index))
+
+    def on_draw(self, e):
+        """Callback called after each full redraw of the figure: caches the background for blitting and draws
+        the animated artists over it.
+        
+        Args:
+            e (event identifier (matplotlib)): is provided automatically by matplotlib when the callback is called.
+        """
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.ax.draw_artist(self.line)
+        self.ax.draw_artist(self.ax.title)
+
+    def needs_rescale(self, spectrum):
+        """Tells whether the y axis has to be rescaled to show spectrum: when it goes out of the current limits
+        or when it uses less than RESCALE_FILL of the height of the plot.
+        
+        Args:
+            spectrum (numpy array): spectrum to plot
+        
+        Returns:
+            bool: True if the y limits have to be updated
+        """
+        y_min, y_max = self.ax.get_ylim()
+        data_min, data_max = float(spectrum.min()), float(spectrum.max())
+        return data_min < y_min or data_max > y_max or (data_max - data_min) < self.RESCALE_FILL * (y_max - y_min)
 
     def plot_spe(self, index):
-        """Update the plot (should be called after init_plot())
+        """Update the plot (should be called after init_plot()). Only the spectrum line and the title are redrawn
+        (blitting), unless the y axis has to be rescaled (see needs_rescale()).
         
         Args:
             index (int): frame index for the new plot
         """
-        self.ax.cla()
-        pl.plot(self.data.wavelength, self.data.data[index][0])
-        pl.xlabel('Wavelength (nm)')
-        pl.ylabel('Intensity (counts/{:.3f} ms)'.format(self.data.exposureTime))
-        pl.title('Spectrum {}/{}'.format(self.curr_pos + 1, self.data.nbOfFrames))
-        self.fig.canvas.draw()
+        spectrum = self.get_frame(index)
+        self.line.set_ydata(spectrum)
+        self.ax.set_title('Spectrum {}/{}'.format(index + 1, self.data.nbOfFrames))
+        if self._background is None or self.needs_rescale(spectrum):
+            data_min, data_max = float(spectrum.min()), float(spectrum.max())
+            margin = 0.05 * (data_max - data_min) or 1.
+            self.ax.set_ylim(data_min - margin, data_max + margin)
+            self.fig.canvas.draw()  # full redraw, on_draw() caches the new background
+        else:
+            self.fig.canvas.restore_region(self._background)
+            self.ax.draw_artist(self.line)
+            self.ax.draw_artist(self.ax.title)
+            self.fig.canvas.blit(self.fig.bbox)
+        self.fig.canvas.flush_events()
+        self.prefetch(index)
 
     def key_event(self, e):
         """Callback called when a key is pressed in the matplotlib window.
@@ -117,7 +322,157 @@ class SpeRead():
 
         self.plot_spe(self.curr_pos)
 
+
+
+class SpeMap():
+
+    AGGREGATIONS = {'max': np.maximum, 'min': np.minimum, 'mean': np.add}  # aggregation: numpy ufunc reducing a block
+    UPDATE_DELAY = 100  # time in ms after the last zoom/resize event before the visible window is aggregated again
+    MEMORY_BUDGET = 64 * 2**20  # memory in bytes allowed to read a chunk of frames for the aggregation
+
+    def __init__(self, filename, aggregation='max', png=None):
+        """Object used to show all the spectra of an SPE file as a map (frames along y, wavelength along x).
+        The map is aggregated down to the resolution of the screen: each displayed pixel is the max, min or mean
+        of a block of frames and wavelength pixels. Zooming aggregates again the visible window only,
+        so that full details are shown when zooming in. Clicking on a row opens the spectrum of this frame.
+        
+        Args:
+            filename (str): path to the SPE file
+            aggregation (str, optional): 'max' (keeps peaks and lines visible), 'min' or 'mean'
+            png (str, optional): if not None, renders the map to this PNG file (without display) instead of showing it
+        """
+        from tools.arrayProcessing import range_to_edge
+
+        self.filename = filename
+        self.aggregation = aggregation
+        self.data = openSPE(filename, memmap=True)
+        self.wavelength_edges = range_to_edge(self.data.wavelength)
+        self.frame_edges = np.arange(self.data.nbOfFrames + 1) - 0.5  # frames are rows of height 1 (also with a single frame)
+        self.spectrum_windows = []
+        self._window = None
+
+        self.fig, plt = new_figure(headless=png is not None)
+        self.ax = self.fig.add_subplot(111)
+        self.ax.set_xlim(self.wavelength_edges[0], self.wavelength_edges[-1])
+        self.ax.set_ylim(self.frame_edges[0], self.frame_edges[-1])
+        self.ax.set_xlabel('Wavelength (nm)')
+        self.ax.set_ylabel('Frame')
+        self.ax.set_title(os.path.basename(filename))
+        self.image = None
+        self.update_image()
+        colorbar = self.fig.colorbar(self.image, ax=self.ax)
+        colorbar.set_label('Intensity (counts/{:.3f} ms, {} of merged pixels)'.format(self.data.exposureTime, aggregation))
+
+        if png is not None:
+            self.fig.savefig(png)
+            return
+        self._timer = self.fig.canvas.new_timer(interval=self.UPDATE_DELAY)
+        self._timer.single_shot = True
+        self._timer.add_callback(self.update_image)
+        self.ax.callbacks.connect('xlim_changed', self.on_view_changed)
+        self.ax.callbacks.connect('ylim_changed', self.on_view_changed)
+        self.fig.canvas.mpl_connect('resize_event', self.on_view_changed)
+        self.fig.canvas.mpl_connect('button_press_event', self.on_click)
+        plt.show()
+
+    def visible_window(self):
+        """Returns the frames and wavelength pixels visible in the axes and the size of the axes on the screen.
+        
+        Returns:
+            tuple: (first frame, frame after the last), (first pixel, pixel after the last), (height, width) in screen pixels
+        """
+        x_min, x_max = sorted(self.ax.get_xlim())
+        y_min, y_max = sorted(self.ax.get_ylim())
+        nb_of_pixels = len(self.wavelength_edges) - 1
+        pixels = (int(np.clip(np.searchsorted(self.wavelength_edges, x_min, side='right') - 1, 0, nb_of_pixels - 1)),
+                  int(np.clip(np.searchsorted(self.wavelength_edges, x_max, side='left'), 1, nb_of_pixels)))
+        frames = (int(np.clip(np.floor(y_min + 0.5), 0, self.data.nbOfFrames - 1)),
+                  int(np.clip(np.ceil(y_max + 0.5), 1, self.data.nbOfFrames)))
+        extent = self.ax.get_window_extent()
+        return frames, pixels, (max(1, int(extent.height)), max(1, int(extent.width)))
+
+    def aggregate(self, frames, pixels, shape):
+        """Reads a window of the spectra (first row of each frame) chunk by chunk and merges blocks of frames and pixels
+        (see aggregation) so that the result is not larger than shape.
+        
+        Args:
+            frames (tuple): (first frame, frame after the last)
+            pixels (tuple): (first pixel, pixel after the last)
+            shape (tuple): maximum size of the result (nb of frame blocks, nb of pixel blocks)
         
+        Returns:
+            tuple: aggregated map (numpy array), edges of the frame blocks and edges of the pixel blocks (indices, numpy arrays)
+        """
+        nb_of_frames, nb_of_pixels = frames[1] - frames[0], pixels[1] - pixels[0]
+        frame_step = -(-nb_of_frames // shape[0])  # ceil division
+        pixel_step = -(-nb_of_pixels // shape[1])
+        reduce_block = self.AGGREGATIONS[self.aggregation].reduceat
+        pixel_starts = np.arange(0, nb_of_pixels, pixel_step)
+        chunk_length = frame_step * max(1, self.MEMORY_BUDGET // (frame_step * nb_of_pixels * 8))
+
+        blocks = []
+        for chunk_start in range(frames[0], frames[1], chunk_length):
+            chunk = self.data.readFrames(chunk_start, min(chunk_start + chunk_length, frames[1]),
+                                         roi=(0, 1, pixels[0], pixels[1]))
+            if type(chunk) == dict:
+                chunk = next(iter(chunk.values()))
+            chunk = chunk[:, 0, :].astype(np.float64)
+            chunk = reduce_block(chunk, np.arange(0, len(chunk), frame_step), axis=0)
+            blocks.append(reduce_block(chunk, pixel_starts, axis=1))
+        image = np.concatenate(blocks)
+
+        frame_block_edges = np.append(np.arange(frames[0], frames[1], frame_step), frames[1])
+        pixel_block_edges = np.append(pixel_starts + pixels[0], pixels[1])
+        if self.aggregation == 'mean':
+            image /= np.outer(np.diff(frame_block_edges), np.diff(pixel_block_edges))
+        return image, frame_block_edges, pixel_block_edges
+
+    def update_image(self):
+        """Aggregates the visible window to the size of the axes and updates the map (nothing is done if
+        the visible window did not change)."""
+        from matplotlib.image import NonUniformImage
+
+        window = self.visible_window()
+        if window == self._window:
+            return
+        self._window = window
+        image, frame_block_edges, pixel_block_edges = self.aggregate(*window)
+        wavelength_block_edges = self.wavelength_edges[pixel_block_edges]
+        block_edges = self.frame_edges[frame_block_edges]
+        x_centers = (wavelength_block_edges[:-1] + wavelength_block_edges[1:]) / 2
+        y_centers = (block_edges[:-1] + block_edges[1:]) / 2
+        if self.image is None:
+            self.image = NonUniformImage(self.ax, interpolation='nearest')
+            self.image.set_data(x_centers, y_centers, image)
+            self.image.set_clim(np.percentile(image, (0.5, 99.5)))
+            self.ax.add_image(self.image)
+        else:
+            self.image.set_data(x_centers, y_centers, image)
+            self.fig.canvas.draw_idle()
+
+    def on_view_changed(self, e):
+        """Callback called when the axes limits or the window size change: the map is aggregated again
+        once the zoom is finished (UPDATE_DELAY ms after the last change).
+        
+        Args:
+            e (event identifier (matplotlib)): is provided automatically by matplotlib when the callback is called.
+        """
+        self._timer.stop()
+        self._timer.start()
+
+    def on_click(self, e):
+        """Callback called when the mouse is clicked in the matplotlib window: opens the spectrum of the clicked frame
+        (except when zooming or panning with the toolbar).
+        
+        Args:
+            e (event identifier (matplotlib)): is provided automatically by matplotlib when the callback is called.
+        """
+        toolbar = getattr(self.fig.canvas.manager, 'toolbar', None)
+        if e.inaxes is not self.ax or e.button != 1 or (toolbar is not None and toolbar.mode):
+            return
+        index = int(np.clip(np.floor(e.ydata + 0.5), 0, self.data.nbOfFrames - 1))
+        self.spectrum_windows.append(SpeRead(self.filename, start_index=index, block=False))
+
 
 if __name__ == '__main__':
     # spe_read(r'/Users/raphaelproux/Desktop/kspace-experiment/DATA/InSe/180112-InSe-fresh-batch-S6GM1/spectra/SPOT-B/180112-S6GM1-FlakeB1-thin-INT-2s-step-glue-700-1100nm-EXC-532nm-0.20V1E3.spe', export='toto.txt')
@@ -5,12 +5,41 @@
 # 
 # Created by R. Proux, 24/01/2018
 
-import matplotlib
-matplotlib.use('Qt5Agg')
-import pylab as pl
+import numpy as np
 import click
 import glob
+import io
 import os
+from concurrent.futures import ProcessPoolExecutor
+from tools.smallFuncs3 import cacheName
+
+SNIFF_SIZE = 8192  # bytes read at the beginning of a file to find its header length and delimiter (see loadtxt_sniff())
+DELIMITERS = (None, ',', ';')  # delimiters tried in this order (None means tab or space), as in loadtxt_gen_delimiter()
+CACHE_KEY_DTYPE = np.dtype([('plottxt_size', '<i8'), ('plottxt_mtime_ns', '<i8')])  # first record of the cache files (see load_cached())
+
+
+def new_figure(headless=False):
+    """Creates a figure, importing the plotting stack only at this point so that the tool starts fast
+    and works on machines without display in headless mode.
+    
+    Args:
+        headless (bool, optional): if True, the figure is rendered with the Agg backend (to files only, no display needed
+                                   and not managed by pyplot), otherwise it is a pyplot figure using Qt5Agg (window)
+    
+    Returns:
+        tuple: matplotlib figure, matplotlib.pyplot module (None if headless)
+    """
+    if headless:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        return fig, None
+    import matplotlib
+    matplotlib.use('Qt5Agg')
+    import matplotlib.pyplot as plt
+    return plt.figure(), plt
+
 
 @click.command()
 @click.argument('filenames', nargs=-1, required=True, type=click.Path(exists=True))
@@ -18,14 +47,23 @@ import os
 @click.option('--columns', '-c', 'force_shape', flag_value='columns', help="Force to interpret columns as the X/Y data vectors.")
 @click.option('--autoshape', '-a', 'force_shape', flag_value='auto', default=True, help="Use the longer side of the array to read the X/Y data vectors.")
 @click.option('--yonly', '-y', is_flag=True, help="Generate X data based on index and consider all rows/columns to be Y data.")
-def plot_file(filenames, force_shape='auto', yonly=False):
+@click.option('--png', '-p', is_flag=True, help="Render each file to a PNG file (name of the file + .png) without display, all files in one process.")
+@click.option('--workers', '-w', type=click.INT, help="Number of processes loading the files (number of processors by default).")
+@click.option('--no-cache', 'cache', flag_value=False, default=True, help="Do not use nor write the .cache files (parsed arrays saved next to the text files).")
+@click.option('--decimation', '-d', type=click.Choice(['minmax', 'lttb', 'none']), default='minmax',
+              help="How long vectors are reduced to the screen resolution (recomputed for the visible window when zooming).")
+@click.option('--evict-caches', is_flag=True, help="Remove the .cache files written by this command whose text file does not exist anymore "
+                                                   "(in the folders of the plotted files).")
+def plot_file(filenames, force_shape='auto', yonly=False, png=False, workers=None, cache=True, decimation='minmax', evict_caches=False):
     """
     Reads and plots text files containing data in columns or lines.
     Will try different types of delimiters and skip automatically rows it cannot interpret at the beginning of the file.
+    The parsed arrays are saved in .cache files next to the text files so that plotting them again is fast.
     """
-    plotfile(filenames, force_shape=force_shape, yonly=yonly)
+    plotfile(filenames, force_shape=force_shape, yonly=yonly, png=png, workers=workers, cache=cache, decimation=decimation,
+             evict_caches=evict_caches)
 
-def plotfile(filenames, force_shape='auto', yonly=False):
+def plotfile(filenames, force_shape='auto', yonly=False, png=False, workers=None, cache=True, decimation='minmax', evict_caches=False):
     """
     Args:
         filenames (tuple or list): list of filenames containing the data to plot (can be parsed with *)
@@ -36,34 +74,271 @@ def plotfile(filenames, force_shape='auto', yonly=False):
                                      'rows' will use the rows as X/Y data
         yonly (bool, optional): Plot all the vectors in the file as Y data (X will then be generated from the vector indices)
                                 If False, the first column/row will be used for X data.
+        png (bool, optional): If True, each file is rendered to its own PNG file (filename + '.png') with the Agg backend
+                              instead of plotting all the files in a window.
+        workers (int, optional): number of processes loading the files in parallel (number of processors if None)
+        cache (bool, optional): If True, the arrays are read from/saved to cache files (see load_cached())
+        decimation (str, optional): 'minmax', 'lttb' or 'none', see DecimatedLine.
+        evict_caches (bool, optional): If True, removes the orphan cache files of the folders of the files (see evict_orphan_caches())
     """
+    list_of_filenames = [filename for filename_pattern in filenames for filename in glob.glob(filename_pattern)
+                         if os.path.isfile(filename) and not filename.endswith(cacheName(''))]
+    if evict_caches:
+        evict_orphan_caches(set(os.path.dirname(filename) for filename in list_of_filenames))
+    file_arrays = load_files(list_of_filenames, workers=workers, cache=cache)
+    if png:
+        for filename, file_array in zip(list_of_filenames, file_arrays):
+            fig, _ = new_figure(headless=True)
+            ax = fig.add_subplot(111)
+            if plot_arrays(ax, file_array, os.path.basename(filename), force_shape=force_shape, yonly=yonly, decimation=decimation):
+                ax.legend()
+                fig.savefig(filename + '.png')
+        return
+
+    fig, plt = new_figure()
+    ax = fig.add_subplot(111)
     plotted_something = False
-    fig = pl.figure()
-    for filename_pattern in filenames:
-        list_of_filenames = glob.glob(filename_pattern)
-        for filename in list_of_filenames:
-            try:
-                file_array = loadtxt_gen_skiprows(filename)
-            except IsADirectoryError:
-                continue
-            # print(file_array.shape)
-            if len(file_array.shape) > 1 and ((file_array.shape[0] > file_array.shape[1] and force_shape == 'auto') or force_shape == 'columns'):
-                file_array = file_array.transpose()
-            if len(file_array.shape) == 1 or yonly:
-                # print(len(file_array), 'YOLOOOOOO', file_array)
-                file_array = pl.vstack([range(file_array.transpose().shape[0]), file_array])
-            for y_vector in file_array[1:]:
-                pl.plot(file_array[0], y_vector, label=os.path.basename(filename))
-                if not plotted_something:
-                    plotted_something = True
+    for filename, file_array in zip(list_of_filenames, file_arrays):
+        plotted_something = plot_arrays(ax, file_array, os.path.basename(filename), force_shape=force_shape, yonly=yonly,
+                                        decimation=decimation) or plotted_something
     if plotted_something:
-        pl.legend()
-        pl.show()
+        ax.legend()
+        plt.show()
+    else:
+        plt.close(fig)
+
+
+def plot_arrays(ax, file_array, label, force_shape='auto', yonly=False, decimation='minmax'):
+    """Plots the vectors of an array read from a text file (see plotfile() for the options).
+    
+    Args:
+        ax (matplotlib axes): axes where to plot
+        file_array (numpy array): array read from the file
+        label (str): legend of the vectors
+        force_shape (str, optional): 'auto', 'columns' or 'rows' (see plotfile())
+        yonly (bool, optional): Plot all the vectors in the file as Y data (see plotfile())
+        decimation (str, optional): 'minmax', 'lttb' or 'none', see DecimatedLine.
+    
+    Returns:
+        bool: True if something was plotted
+    """
+    # print(file_array.shape)
+    if len(file_array.shape) > 1 and ((file_array.shape[0] > file_array.shape[1] and force_shape == 'auto') or force_shape == 'columns'):
+        file_array = file_array.transpose()
+    if len(file_array.shape) == 1 or yonly:
+        # print(len(file_array), 'YOLOOOOOO', file_array)
+        file_array = np.vstack([range(file_array.transpose().shape[0]), file_array])
+    for y_vector in file_array[1:]:
+        if decimation == 'none':
+            ax.plot(file_array[0], y_vector, label=label)
+        else:
+            DecimatedLine(ax, file_array[0], y_vector, method=decimation, label=label)
+    return len(file_array) > 1
+
+
+def min_max_envelope(x, y, nb_of_bins):
+    """Reduces a vector to the minimum and maximum of each of nb_of_bins bins of consecutive points: plotted as a line,
+    the result draws the same envelope as the full vector at a resolution of nb_of_bins pixels.
+    
+    Args:
+        x (numpy array): X data, sorted
+        y (numpy array): Y data
+        nb_of_bins (int): number of bins (should be less than len(x))
+    
+    Returns:
+        tuple: X data (2 points per bin at the X of the first point of the bin), Y data (minimum and maximum of each bin)
+    """
+    starts = np.linspace(0, len(x), nb_of_bins, endpoint=False).astype(np.int64)
+    y_envelope = np.column_stack([np.fmin.reduceat(y, starts), np.fmax.reduceat(y, starts)])  # NaN only for bins of NaN
+    return np.repeat(x[starts], 2), y_envelope.ravel()
+
+
+def lttb(x, y, nb_of_points):
+    """Downsamples a vector with the Largest-Triangle-Three-Buckets algorithm (S. Steinarsson, 2013): the first and
+    last points are kept and one point is selected in each bucket of consecutive points, the one forming the largest
+    triangle with the point selected in the previous bucket and the average of the next bucket.
+    
+    Args:
+        x (numpy array): X data, sorted
+        y (numpy array): Y data
+        nb_of_points (int): number of points to keep (at least 3, should be less than len(x))
+    
+    Returns:
+        tuple: X data, Y data of the selected points
+    """
+    edges = np.linspace(1, len(x) - 1, nb_of_points - 1).astype(np.int64)  # nb_of_points - 2 buckets between first and last points
+    next_edges = np.append(edges[2:], len(x))
+    sums_x, sums_y = np.concatenate([[0], np.cumsum(x)]), np.concatenate([[0], np.cumsum(y)])
+    next_average_x = np.append((sums_x[next_edges] - sums_x[edges[1:]]) / (next_edges - edges[1:]), x[-1])
+    next_average_y = np.append((sums_y[next_edges] - sums_y[edges[1:]]) / (next_edges - edges[1:]), y[-1])
+    selected = np.empty(nb_of_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, len(x) - 1
+    for i in range(nb_of_points - 2):
+        a = selected[i]
+        bucket_x, bucket_y = x[edges[i]:edges[i + 1]], y[edges[i]:edges[i + 1]]
+        areas = np.abs((x[a] - next_average_x[i]) * (bucket_y - y[a]) - (x[a] - bucket_x) * (next_average_y[i] - y[a]))
+        selected[i + 1] = edges[i] + np.argmax(areas)
+    return x[selected], y[selected]
+
+
+class DecimatedLine():
+
+    MAX_POINTS_PER_PIXEL = 2  # vectors with more points than this per horizontal pixel of the axes are decimated
+
+    def __init__(self, ax, x, y, method='minmax', **plot_options):
+        """Line plotting a long vector reduced to the resolution of the screen, for the visible X window only: 
+        min/max envelope of the points falling in each pixel ('minmax', see min_max_envelope()) or Largest-Triangle-Three-Buckets
+        downsampling ('lttb', see lttb()). The reduction is computed again when the X limits change (zoom, pan),
+        so that all the points are plotted once zoomed enough. Vectors with unsorted X data or less than 2 points are plotted completely.
+        
+        Args:
+            ax (matplotlib axes): axes where to plot
+            x (numpy array): X data
+            y (numpy array): Y data
+            method (str, optional): 'minmax' or 'lttb'
+            **plot_options: options passed to ax.plot (label, color, etc.)
+        """
+        self.ax = ax
+        self.method = method
+        self.x, self.y = np.asarray(x), np.asarray(y)
+        if len(self.x) > 1 and self.x[0] > self.x[-1]:
+            self.x, self.y = self.x[::-1], self.y[::-1]
+        self.sorted = bool(np.all(self.x[1:] >= self.x[:-1]))
+        if not self.sorted or len(self.x) < 2:  # nothing to decimate (unsorted, empty or single point vectors)
+            self.line, = ax.plot(self.x, self.y, **plot_options)
+            return
+        self.line, = ax.plot(*self.decimate(self.x[0], self.x[-1]), **plot_options)
+        ax.callbacks.connect('xlim_changed', lambda ax: self.line.set_data(*self.decimate(*sorted(ax.get_xlim()))))
+
+    def decimate(self, x_min, x_max):
+        """Reduces the points between x_min and x_max to the resolution of the axes (see DecimatedLine).
+        
+        Args:
+            x_min (float): left limit of the visible window
+            x_max (float): right limit of the visible window
+        
+        Returns:
+            tuple: X data, Y data to plot
+        """
+        start = max(np.searchsorted(self.x, x_min, side='left') - 1, 0)  # one more point on each side so that the line
+        stop = min(np.searchsorted(self.x, x_max, side='right') + 1, len(self.x))  # goes to the edges of the axes
+        nb_of_pixels = max(1, int(self.ax.get_window_extent().width))
+        if stop - start <= self.MAX_POINTS_PER_PIXEL * nb_of_pixels:
+            return self.x[start:stop], self.y[start:stop]
+        if self.method == 'lttb':
+            return lttb(self.x[start:stop], self.y[start:stop], self.MAX_POINTS_PER_PIXEL * nb_of_pixels)
+        return min_max_envelope(self.x[start:stop], self.y[start:stop], nb_of_pixels)
+
+
+def load_files(filenames, workers=None, cache=True):
+    """Loads text files, the files not found in the cache being parsed in parallel in a pool of processes
+    (see load_cached()).
+    
+    Args:
+        filenames (list): paths to the files
+        workers (int, optional): number of processes (number of processors if None). 
+                                 With 1 worker or 1 file to parse, the files are parsed in the current process.
+        cache (bool, optional): If True, the arrays are read from/saved to cache files (see load_cached())
+    
+    Returns:
+        list: numpy arrays read from the files (same order as filenames)
+    """
+    file_arrays = [read_cache(filename) if cache else None for filename in filenames]
+    to_parse = [i for i, file_array in enumerate(file_arrays) if file_array is None]
+    load_func = load_cached if cache else loadtxt_sniff
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(to_parse) <= 1:
+        parsed_arrays = [load_func(filenames[i]) for i in to_parse]
     else:
-        pl.close(fig)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed_arrays = list(executor.map(load_func, [filenames[i] for i in to_parse],
+                                              chunksize=max(1, len(to_parse) // (4 * workers))))
+    for i, file_array in zip(to_parse, parsed_arrays):
+        file_arrays[i] = file_array
+    return file_arrays
 
 
-def loadtxt_gen_delimiter(filename, load_func=pl.loadtxt, **opt_dict):
+def cache_key(filename):
+    """Returns the key identifying the version of a text file in its cache file (see load_cached()).
+    
+    Args:
+        filename (str): Path to the text file
+    
+    Returns:
+        numpy array: size and modification time in ns of the file (CACHE_KEY_DTYPE record)
+    """
+    stat = os.stat(filename)
+    return np.array((stat.st_size, stat.st_mtime_ns), dtype=CACHE_KEY_DTYPE)
+
+
+def read_cache(filename):
+    """Reads the array of a text file from its cache file (see load_cached()).
+    
+    Args:
+        filename (str): Path to the text file
+    
+    Returns:
+        numpy array: array of the text file, None if there is no valid cache file for the current version of the file
+    """
+    try:
+        with open(cacheName(filename), 'rb') as fid:
+            key = np.load(fid)
+            if key.dtype == CACHE_KEY_DTYPE and key == cache_key(filename):
+                return np.load(fid)
+    except (OSError, ValueError, EOFError):  # no cache file or unreadable cache file
+        pass
+    return None
+
+
+def load_cached(filename):
+    """Reads data from a text file (see loadtxt_sniff()) through a cache file next to it (see smallFuncs3.cacheName()).
+    The cache file contains two .npy records: the key (see cache_key()) and the array. It is used only 
+    if the key matches the text file, otherwise the text file is parsed and the stale cache file is replaced.
+    
+    Args:
+        filename (str): Path to the file to read
+    
+    Returns:
+        numpy array: numpy array read from the file
+    """
+    file_array = read_cache(filename)
+    if file_array is not None:
+        return file_array
+    key = cache_key(filename)
+    file_array = loadtxt_sniff(filename)
+    cache_filename = cacheName(filename)
+    try:
+        with open(cache_filename + '.tmp', 'wb') as fid:
+            np.save(fid, key)
+            np.save(fid, file_array)
+        os.replace(cache_filename + '.tmp', cache_filename)  # atomic, the stale cache is replaced
+    except OSError:  # read-only folder: no cache
+        pass
+    return file_array
+
+
+def evict_orphan_caches(folders):
+    """Removes the cache files written by load_cached() whose text file does not exist anymore.
+    Only the files starting with a cache key record (see cache_key()) are removed, other .cache files are left untouched.
+    
+    Args:
+        folders (iterable): folders where to look for cache files
+    """
+    cache_extension = cacheName('')
+    for folder in folders:
+        for cache_filename in glob.glob(os.path.join(glob.escape(folder or '.'), '*' + cache_extension)):
+            if os.path.exists(cache_filename[:-len(cache_extension)]):
+                continue
+            try:
+                with open(cache_filename, 'rb') as fid:
+                    is_cache = np.load(fid).dtype == CACHE_KEY_DTYPE  # only remove the cache files of load_cached()
+                if is_cache:
+                    os.remove(cache_filename)
+            except (OSError, ValueError, EOFError):  # not a .npy file (or a pickled one)
+                pass
+
+
+def loadtxt_gen_delimiter(filename, load_func=np.loadtxt, **opt_dict):
     """Wrapper for a numpy.loadtxt style function which reads data from a text file, here trying
     different delimiters (None means tab or space, comma and semi-colon)
     
@@ -107,6 +382,61 @@ def loadtxt_gen_skiprows(filename, load_func=loadtxt_gen_delimiter, **opt_dict):
         else:
             break
 
+
+def sniff_text_format(lines, complete=True):
+    """Finds the number of header lines and the delimiter of a text file from its first lines, trying the header
+    sizes and the delimiters in the same order as loadtxt_gen_skiprows() and loadtxt_gen_delimiter().
+    
+    Args:
+        lines (list): first lines of the file (complete lines only)
+        complete (bool, optional): True if lines is the whole file (then skipping all the lines is also tried,
+                                   which gives an empty array as loadtxt_gen_skiprows() does)
+    
+    Returns:
+        tuple: number of header lines, delimiter, array read from the lines after the header.
+               None if no header size and delimiter can read the lines.
+    """
+    for skiprows in range(len(lines) + 1 if complete else len(lines)):
+        for delimiter in DELIMITERS:
+            try:
+                return skiprows, delimiter, np.loadtxt(lines[skiprows:], delimiter=delimiter)
+            except ValueError:
+                continue
+    return None
+
+def loadtxt_sniff(filename, sample_size=SNIFF_SIZE):
+    """Reads data from a text file like loadtxt_gen_skiprows() (same result) but faster: the header length
+    and the delimiter are found once from the first sample_size bytes (see sniff_text_format(), the sample
+    is doubled until it contains numeric lines), then the numeric body is parsed in one pass. 
+    Falls back on loadtxt_gen_skiprows() if the end of the file cannot be read with the format found at its beginning.
+    
+    Args:
+        filename (str): Path to the file to read
+        sample_size (int, optional): number of bytes first read to find the format of the file
+    
+    Returns:
+        numpy array: numpy array read from the file
+    """
+    with open(filename, 'rb') as fid:
+        sample = fid.read(sample_size)
+        while True:
+            next_bytes = fid.read(len(sample) or 1)
+            complete = next_bytes == b''
+            lines = io.StringIO(sample.decode('latin-1'), newline=None).readlines()  # universal newlines, as loadtxt
+            if not complete:
+                lines = lines[:-1]  # the last line may be cut
+            text_format = sniff_text_format(lines, complete)
+            if text_format is not None or complete:
+                break
+            sample += next_bytes
+    skiprows, delimiter, sample_array = text_format
+    if complete:
+        return sample_array
+    try:
+        return np.loadtxt(filename, skiprows=skiprows, delimiter=delimiter)
+    except ValueError:
+        return loadtxt_gen_skiprows(filename)
+
 if __name__ == '__main__':
     
     plot_file([r'/Users/raphaelproux/Desktop/test-plotuni/test-*.txt'])
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Benchmark of the text loaders of univPlot (plottxt) on synthetic instrument exports.
+# Run this file directly to execute the benchmark.
+# 
+# Created on Sun Oct 18 2026
+
+import numpy as np
+import os
+import tempfile
+import time
+from univPlot import loadtxt_gen_skiprows, loadtxt_sniff
+
+
+def write_export(filename, nb_of_lines, nb_of_columns, header_lines, delimiter):
+    """Writes a synthetic instrument export: a text header followed by columns of numbers.
+    
+    Args:
+        filename (str): path to the file to write
+        nb_of_lines (int): number of lines of data
+        nb_of_columns (int): number of columns of data
+        header_lines (int): number of lines of the header
+        delimiter (str): delimiter between the columns
+    """
+    header = ''.join('Parameter {}: value {} (instrument settings)\n'.format(i, i * 3.7) for i in range(header_lines))
+    data = np.column_stack([np.linspace(400, 1100, nb_of_lines)] + [np.random.poisson(1000, nb_of_lines)] * (nb_of_columns - 1))
+    with open(filename, 'w') as fid:
+        fid.write(header)
+        np.savetxt(fid, data, delimiter=delimiter, fmt='%.6g')
+
+
+def benchmark_loaders(nb_of_lines=200000, nb_of_columns=4, header_lines=40, delimiters=('\t', ',', ';'), folder=None):
+    """Compares the time needed by loadtxt_gen_skiprows() and loadtxt_sniff() to read synthetic exports
+    and checks that both give the same array.
+    
+    Args:
+        nb_of_lines (int, optional): number of lines of data in each file
+        nb_of_columns (int, optional): number of columns of data
+        header_lines (int, optional): number of lines of the header
+        delimiters (tuple, optional): delimiters to test (one file per delimiter)
+        folder (str, optional): folder where to generate the files (temporary folder if None)
+    
+    Returns:
+        dict: for each delimiter, time in seconds of each loader
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(dir=folder) as temp_folder:
+        for delimiter in delimiters:
+            filename = os.path.join(temp_folder, 'export.txt')
+            write_export(filename, nb_of_lines, nb_of_columns, header_lines, delimiter)
+            arrays = {}
+            results[delimiter] = {}
+            for name, loader in (('loadtxt_gen_skiprows', loadtxt_gen_skiprows), ('loadtxt_sniff', loadtxt_sniff)):
+                start_time = time.perf_counter()
+                arrays[name] = loader(filename)
+                results[delimiter][name] = time.perf_counter() - start_time
+            assert np.array_equal(arrays['loadtxt_gen_skiprows'], arrays['loadtxt_sniff'])
+
+    print('Text exports of {} lines x {} columns with a {} lines header:'.format(nb_of_lines, nb_of_columns, header_lines))
+    for delimiter, timings in results.items():
+        print('    delimiter {!r:5}: '.format(delimiter) + ', '.join('{} {:.3f} s'.format(name, duration) for name, duration in timings.items()))
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_loaders()
+    benchmark_loaders(nb_of_lines=20000, header_lines=400)
@@ -19,8 +19,9 @@ If not installed install it using PIP typing "pip install xmltodict" in a termin
 
 """
 
-import pylab as pl
+import numpy as np
 import time
+from tools.instruments.princeton3.SPEreduce import reduceFrames, REDUCTIONS, MEMORYBUDGET
 
 class SPE2file():
     """First note: you probably should use the SPE2map class below which provides a standardized interface to the data.
@@ -51,6 +52,9 @@ class SPE2file():
         DetTemperature (float): Detector Temperature Set
         Exposure (float): alternative exposure, in sec.
         fname (str): filename 
+        headerOnly (bool): if True, only the header was read and the data array is None
+        HEADERDTYPE (numpy dtype): structured data type describing the WinSpec header layout
+        memmap (bool): if True, the data array is a read-only memory map of the file (see _readArray())
         Gain (WORD): gain
         GeometricOps (WORD): geometric ops: rotate 0x01, reverse 0x02, flip 0x04
         LogicOutput (short): definition of output BNC
@@ -58,6 +62,8 @@ class SPE2file():
         NumROI (int): number of ROIs used. if 0 assume 1.
         NumROIExperiment (int): May be more than the 10 allowed in this header (if 0, assume 1)
         ShutterControl (WORD): Normal, Disabled Open, Disabled Closed.
+        SpecCenterWlNm (float): center wavelength of the spectrometer in nm
+        SpecGrooves (float): grating grooves per mm
         SPEversion (float): version of this file header
         TEXTCOMMENTMAX (int): number of characters in a comment.
         ThresholdMax (float): Threshold maximum value
@@ -74,8 +80,35 @@ class SPE2file():
     NCOMMENTS = 5
     DATEMAX = 10
     TIMEMAX = 7
+
+    # WinSpec header layout (only the fields used by this class), read in one go by _readHeader()
+    HEADERDTYPE = np.dtype({'names': ['ControllerVersion', 'LogicOutput', 'AmpHiCapLowNoise', 'xDimDet', 'TimingMode',
+                                      'Exposure', 'VChipXdim', 'VChipYdim', 'yDimDet', 'date', 'DetTemperature',
+                                      'DetectorType', 'xdim', 'TriggerDiode', 'DelayTime', 'ShutterControl',
+                                      'AbsorbLive', 'AbsorbMode', 'CanDoVirtualChip', 'ThresholdMinLive', 'ThresholdMin',
+                                      'ThresholdMaxLive', 'ThresholdMax', 'SpecCenterWlNm', 'datatype',
+                                      'ExperimentTimeLocal', 'ADCOffset', 'ADCRate', 'ADCType', 'ADCRes', 'ADCBitAdj',
+                                      'Gain', 'Comments', 'GeometricOps', 'SpecGrooves', 'ydim', 'NumFrames',
+                                      'NumROIExperiment', 'NumROI', 'ROIinfo', 'SPEversion', 'polynom_coeff_x'],
+                            'formats': ['<i2', '<i2', '<i2', '<i2', '<i2',
+                                        '<f4', '<i2', '<i2', '<i2', 'S%d' % DATEMAX, '<f4',
+                                        '<i2', '<i2', '<i2', '<f4', '<i2',
+                                        '<i2', '<i2', '<i2', '<i2', '<f4',
+                                        '<i2', '<f4', '<f4', '<i2',
+                                        'S%d' % TIMEMAX, '<i2', '<i2', '<i2', '<i2', '<i2',
+                                        '<i2', ('S%d' % TEXTCOMMENTMAX, NCOMMENTS), '<i2', '<f4', '<i2', '<u4',
+                                        '<i2', '<i2', ('<i2', (10, 6)), '<f4', ('<f8', 6)],
+                            'offsets': [0, 2, 4, 6, 8,
+                                        10, 14, 16, 18, 20, 36,
+                                        40, 42, 44, 46, 50,
+                                        52, 54, 56, 58, 60,
+                                        64, 66, 72, 108,
+                                        172, 188, 190, 192, 194, 196,
+                                        198, 200, 600, 650, 656, 1446,
+                                        1488, 1510, 1512, 1992, 3263],
+                            'itemsize': DATASTART})
     
-    def __init__(self, fname=None, fid=None):
+    def __init__(self, fname=None, fid=None, memmap=False, headerOnly=False):
         """
         This function initializes the class and, if either a filename or fid is
             provided, opens the datafile and reads the contents.
@@ -83,14 +116,20 @@ class SPE2file():
         Parameters:
             fname (str, optional): Filename of SPE file
             fid (file, optional): File ID object of open stream (NOTE: never tested)
+            memmap (bool, optional): if True, the data is not loaded in memory but accessed through a 
+                                     read-only memory map of the file (frames are read from disk only when used).
+            headerOnly (bool, optional): if True, only the header is read (the data block is never touched).
         """
         
         self._fid = None
         self.fname = fname
+        self.memmap = memmap
+        self.headerOnly = headerOnly
         if fname is not None:
             self.openFile(fname)
         elif fid is not None:
             self._fid = fid
+            self._fname = self.fname = getattr(fid, 'name', None)
 
         if self._fid:
             self.readData()
@@ -169,13 +208,31 @@ class SPE2file():
         return self._array
 
     def getBinnedData(self):
-        """Return the binned (sum of all frames) data
+        """Return the binned (sum of all frames) data.
+        In memmap and header-only modes, the frames are summed chunk by chunk (see reduceFrames()).
         
         Returns:
             numpy array: the sum of all frames (1D array)
         """
+        if self.memmap or self.headerOnly:
+            return self.reduceFrames(('sum',))['sum']
         return self._array.sum(0)
 
+    def reduceFrames(self, reductions=REDUCTIONS, reducer=None, memoryBudget=MEMORYBUDGET):
+        """Computes reductions over all the frames in one pass, streaming the frames from the file 
+        in chunks which fit in memoryBudget (see SPEreduce.reduceFrames()).
+        
+        Args:
+            reductions (iterable, optional): reductions to compute among 'sum', 'mean', 'max', 'min' and 'var'
+            reducer (function, optional): user reduction called as accumulator = reducer(chunk, accumulator)
+            memoryBudget (int, optional): working memory allowed for a chunk of frames, in bytes
+        
+        Returns:
+            dict: result of each reduction (frame-shaped arrays), the result of reducer is under 'reducer'
+        """
+        frames = self._array if self._array is not None else self._mapArray(self._fname)
+        return reduceFrames(frames, reductions, reducer, memoryBudget)
+
     def readData(self):
         """Read all the data into the class"""
         self._readHeader()
@@ -184,7 +241,10 @@ class SPE2file():
         self._readAllROI()
         self._readDate()
         self._readWavelengths()
-        self._readArray()
+        if self.headerOnly:
+            self._array = None
+        else:
+            self._readArray()
 
     def openFile(self, fname):
         """Open a SPE file"""
@@ -250,106 +310,89 @@ class SPE2file():
             number or numpy array: numpy array of read numbers if several numbers (size > 1). Simple number otherwise.
         """
         self._fid.seek(pos)
-        return pl.fromfile(self._fid, ntype, size)
+        return np.fromfile(self._fid, ntype, size)
 
-    def _readAtString(self, pos, size):
-        """Reads a string from the file.
-        
-        Args:
-            pos (int): Position in the file in bytes.
-            size (int): Number of characters to be read (-1 for all characters)
+    def _readHeader(self):
+        """Reads the whole header in one go (decoded with HEADERDTYPE) and extracts all other information"""
+        self._header = self._readAtNumpy(0, 1, self.HEADERDTYPE)[0]
+        self.ControllerVersion = self._header['ControllerVersion']
+        self.LogicOutput = self._header['LogicOutput']
+        self.AmpHiCapLowNoise = self._header['AmpHiCapLowNoise']
+        self.TimingMode = self._header['TimingMode']
+        self.Exposure = self._header['Exposure'] * 1000.
+        self.DetTemperature = self._header['DetTemperature']
+        self.DetectorType = self._header['DetectorType']
+        self.TriggerDiode = self._header['TriggerDiode']
+        self.DelayTime = self._header['DelayTime']
+        self.ShutterControl = self._header['ShutterControl']
+        self.AbsorbLive = self._header['AbsorbLive']
+        self.AbsorbMode = self._header['AbsorbMode']
+        self.CanDoVirtualChip = self._header['CanDoVirtualChip']
+        self.ThresholdMinLive = self._header['ThresholdMinLive']
+        self.ThresholdMin = self._header['ThresholdMin']
+        self.ThresholdMaxLive = self._header['ThresholdMaxLive']
+        self.ThresholdMax = self._header['ThresholdMax']
+        self.ADCOffset = self._header['ADCOffset']
+        self.ADCRate = self._header['ADCRate']
+        self.ADCType = self._header['ADCType']
+        self.ADCRes = self._header['ADCRes']
+        self.ADCBitAdj = self._header['ADCBitAdj']
+        self.Gain = self._header['Gain']
+        self.GeometricOps = self._header['GeometricOps']
+        self.SpecCenterWlNm = self._header['SpecCenterWlNm']
+        self.SpecGrooves = self._header['SpecGrooves']
         
-        Returns:
-            str: string read from file.
-        """
-        self._fid.seek(pos)
-        return str(self._fid.read(size).rstrip(chr(0).encode('ascii')), encoding='utf-8')
+        # added
+        self.SPEversion = self._header['SPEversion']
 
-    def _readInt(self, pos):
-        """Reads one integer from the file
+    def _decodeString(self, rawString):
+        """Decodes a string field of the header.
         
         Args:
-            pos (int): Position in the file in bytes
+            rawString (bytes): raw string read from the header (numpy strips the trailing null characters).
         
         Returns:
-            int: integer number read from the file.
+            str: decoded string.
         """
-        return self._readAtNumpy(pos, 1, pl.int16)[0]
-    
-    def _readFloat(self, pos):
-        """Reads one float from the file
-        
-        Args:
-            pos (int): Position in the file in bytes
-        
-        Returns:
-            float: float number read from the file.
-        """
-        return self._readAtNumpy(pos, 1, pl.float32)[0]
-
-    def _readHeader(self):
-        """This routine contains all other information"""
-        self.ControllerVersion = self._readInt(0)
-        self.LogicOutput = self._readInt(2)
-        self.AmpHiCapLowNoise = self._readInt(4)
-        self.TimingMode = self._readInt(8)
-        self.Exposure = self._readFloat(10) * 1000.
-        self.DetTemperature = self._readFloat(36)
-        self.DetectorType = self._readInt(40)
-        self.TriggerDiode = self._readInt(44)
-        self.DelayTime = self._readFloat(46)
-        self.ShutterControl = self._readInt(50)
-        self.AbsorbLive = self._readInt(52)
-        self.AbsorbMode = self._readInt(54)
-        self.CanDoVirtualChip = self._readInt(56)
-        self.ThresholdMinLive = self._readInt(58)
-        self.ThresholdMin = self._readFloat(60)
-        self.ThresholdMaxLive = self._readInt(64)
-        self.ThresholdMax = self._readFloat(66)
-        self.ADCOffset = self._readInt(188)
-        self.ADCRate = self._readInt(190)
-        self.ADCType = self._readInt(192)
-        self.ADCRes = self._readInt(194)
-        self.ADCBitAdj = self._readInt(196)
-        self.Gain = self._readInt(198)
-        self.GeometricOps = self._readInt(600)
-        
-        # added
-        self.SPEversion = self._readFloat(1992)
+        return str(rawString, encoding='utf-8')
 
     def _readAllROI(self):
         """Determines the number of ROIs. However, note this library does not support multiple ROIs (untested and not likely!!).
+        MUST BE CALLED AFTER _readHeader()
         """
-        self.allROI = self._readAtNumpy(1512, 60, pl.int16).reshape(-1,6)
-        self.NumROI = self._readAtNumpy(1510, 1, pl.int16)[0]
-        self.NumROIExperiment = self._readAtNumpy(1488, 1, pl.int16)[0]
+        self.allROI = self._header['ROIinfo']
+        self.NumROI = self._header['NumROI']
+        self.NumROIExperiment = self._header['NumROIExperiment']
         if self.NumROI == 0:
             self.NumROI = 1
         if self.NumROIExperiment == 0:
             self.NumROIExperiment = 1
     
     def _readDate(self):
-        """Reads the date of the measurement from the file."""
-        _date = self._readAtString(20, self.DATEMAX)
-        _time = self._readAtString(172, self.TIMEMAX)
+        """Reads the date of the measurement from the file.
+        MUST BE CALLED AFTER _readHeader()
+        """
+        _date = self._decodeString(self._header['date'])
+        _time = self._decodeString(self._header['ExperimentTimeLocal'])
         self._filedate = time.strptime(_date + _time, "%d%b%Y%H%M%S")
         
     def _readSize(self):
         """Reads all the size records of the header (data size, chip size, virtual chip size if ROIs) 
         and determines the recorded data type.
+        MUST BE CALLED AFTER _readHeader()
         
         Raises:
             Exception: If the data type is not known.
         """
-        xdim = self._readAtNumpy(42, 1, pl.int16)[0]
-        ydim = self._readAtNumpy(656, 1, pl.int16)[0]
-        zdim = self._readAtNumpy(1446, 1, pl.uint32)[0]
-        dxdim = self._readAtNumpy(6, 1, pl.int16)[0]
-        dydim = self._readAtNumpy(18, 1, pl.int16)[0]
-        vxdim = self._readAtNumpy(14, 1, pl.int16)[0]
-        vydim = self._readAtNumpy(16, 1, pl.int16)[0]
-        dt = pl.int16(self._readAtNumpy(108, 1, pl.int16)[0])
-        data_types = (pl.float32, pl.int32, pl.int16, pl.uint16)
+        xdim = self._header['xdim']
+        ydim = self._header['ydim']
+        zdim = self._header['NumFrames']
+        dxdim = self._header['xDimDet']
+        dydim = self._header['yDimDet']
+        vxdim = self._header['VChipXdim']
+        vydim = self._header['VChipYdim']
+        dt = self._header['datatype']
+        data_types = (np.float32, np.int32, np.int16, np.uint16)
         if (dt > 3) or (dt < 0):
             raise Exception("Unknown data type")
         self._dataType = data_types[dt]
@@ -358,24 +401,60 @@ class SPE2file():
         self._vChipSize = (vydim, vxdim)
         
     def _readComments(self):
-        """Reads all the comments. Class internal use only, please use the getComment() getter method to access them.""" 
-        self._comments = []
-        for n in range(5):
-            self._comments.append(
-                self._readAtString(200 + (n * self.TEXTCOMMENTMAX), self.TEXTCOMMENTMAX))
+        """Reads all the comments. Class internal use only, please use the getComment() getter method to access them.
+        MUST BE CALLED AFTER _readHeader()
+        """ 
+        self._comments = [self._decodeString(comment) for comment in self._header['Comments']]
 
     def _readArray(self):
-        """Reads the data array. Class internal use only, please use the getData() getter method to access the data."""
-        self._fid.seek(self.DATASTART)
-        self._array = pl.fromfile(self._fid, dtype=self._dataType, count=-1)
-        self._array = self._array.reshape(self._size)
+        """Reads the data array. Class internal use only, please use the getData() getter method to access the data.
+        In memmap mode, the array is a read-only memory map of the data block (nothing is read from the disk here).
+        """
+        if self.memmap:
+            self._array = self._mapArray(self._fid)
+        else:
+            self._fid.seek(self.DATASTART)
+            self._array = np.fromfile(self._fid, dtype=self._dataType, count=-1)
+            self._array = self._array.reshape(self._size)
+        
+    def _mapArray(self, source):
+        """Maps the data block of the file in memory (read-only).
+        MUST BE CALLED AFTER _readSize()
+        
+        Args:
+            source (str or file): filename or file object of the SPE file
+        
+        Returns:
+            numpy memmap: memory map of the data array (nb of frames, nb of pixels along y, nb of pixels along x)
+        """
+        return np.memmap(source, dtype=self._dataType, mode='r', offset=self.DATASTART, shape=self._size)
+
+    def readFrames(self, start=0, stop=None, step=1, roi=None):
+        """Reads a range of frames, possibly restricted to a window of pixels. Only the requested frames
+        and pixels are read from the disk (even in header-only mode), the other frames are not loaded.
         
+        Args:
+            start (int, optional): index of the first frame
+            stop (int, optional): index after the last frame (until the end of the file if None)
+            step (int, optional): step between the frames
+            roi (tuple, optional): pixel window (y0, y1, x0, x1), same meaning as slice indices. All pixels if None.
+        
+        Returns:
+            numpy array: contiguous array of the frames (nb of frames, nb of pixels along y, nb of pixels along x)
+        """
+        window = (slice(start, stop, step),)
+        if roi is not None:
+            window += (slice(roi[0], roi[1]), slice(roi[2], roi[3]))
+        frames = self._array if self._array is not None else self._mapArray(self._fname)
+        return np.array(frames[window])
+
     def _readWavelengths(self):
         """Calculates the wavelength vector using the calibration coefficients recorded in the file. 
         Class internal use only, please use the getWavelength() getter method to access the data.
+        MUST BE CALLED AFTER _readHeader()
         """
-        polyCoeffs = self._readAtNumpy(3263, 6, pl.double)
-        self._wavelengths = pl.poly1d(polyCoeffs[::-1])(pl.array(range(self._size[2])))
+        polyCoeffs = self._header['polynom_coeff_x']
+        self._wavelengths = np.poly1d(polyCoeffs[::-1])(np.array(range(self._size[2])))
         
 
 class SPE2map:
@@ -384,8 +463,9 @@ class SPE2map:
     Reliable attributes (standardized interface): data, exposureTime, nbOfFrames, regionSize, SPEversion and wavelength.
     
     Attributes:
-        data (numpy array): numpy array containing the frames
+        data (numpy array): numpy array containing the frames (numpy memmap in memmap mode, None in header-only mode)
         exposureTime (float): exposure time of each frame in seconds
+        fname (str): filename
         nbOfFrames (int): number of frames recorded in the file
         pyspecFile (SPE2file object): SPE2file object handling the file reading (internal)
         regionSize (tuple): size of a frame (nb of pixels along y (1 for a simple spectrum), nb of pixels along x)
@@ -393,7 +473,7 @@ class SPE2map:
         wavelength (numpy array): array of floats containing the wavelengths read from the file calibration constants.
     """
     
-    def __init__(self, fname=None, fid=None):
+    def __init__(self, fname=None, fid=None, memmap=False, headerOnly=False):
         """
         This function initializes the class and, if either a filename or fid is
             provided, opens the datafile and reads the contents.
@@ -401,25 +481,56 @@ class SPE2map:
         Parameters:
             fname (str, optional): Filename of SPE file
             fid (file, optional): File ID object of open stream (NOTE: never tested)
+            memmap (bool, optional): if True, data is a read-only memory map of the file instead of an array in memory.
+            headerOnly (bool, optional): if True, only the header is read and data is None (fast metadata scans).
         """
         
-        self.pyspecFile = SPE2file(fname=fname, fid=fid)
+        self.pyspecFile = SPE2file(fname=fname, fid=fid, memmap=memmap, headerOnly=headerOnly)
         if self.pyspecFile._fid is not None:
             self._readData()
             
     def _readData(self):
         """Reads the data from the SPE2file object. Internal use only.
         """
+        self.fname = self.pyspecFile.fname
         self.wavelength = self.pyspecFile.getWavelengths()
         self.regionSize = self.pyspecFile.getSize()[1:]
         self.nbOfFrames = self.pyspecFile.getSize()[0]
         self.exposureTime = self.pyspecFile.Exposure
         self.data = self.pyspecFile.getData()
         self.SPEversion = self.pyspecFile.SPEversion
+
+    def readFrames(self, start=0, stop=None, step=1, roi=None):
+        """Reads a range of frames, possibly restricted to a window of pixels, without loading the other frames.
+        
+        Args:
+            start (int, optional): index of the first frame
+            stop (int, optional): index after the last frame (until the end of the file if None)
+            step (int, optional): step between the frames
+            roi (tuple, optional): pixel window (y0, y1, x0, x1), same meaning as slice indices. All pixels if None.
+        
+        Returns:
+            numpy array: contiguous array of the frames (nb of frames, nb of pixels along y, nb of pixels along x)
+        """
+        return self.pyspecFile.readFrames(start, stop, step, roi)
+
+    def reduceFrames(self, reductions=REDUCTIONS, reducer=None, memoryBudget=MEMORYBUDGET):
+        """Computes reductions over all the frames in one pass, streaming the frames from the file in chunks.
+        
+        Args:
+            reductions (iterable, optional): reductions to compute among 'sum', 'mean', 'max', 'min' and 'var'
+            reducer (function, optional): user reduction called as accumulator = reducer(chunk, accumulator)
+            memoryBudget (int, optional): working memory allowed for a chunk of frames, in bytes
+        
+        Returns:
+            dict: result of each reduction (frame-shaped arrays), the result of reducer is under 'reducer'
+        """
+        return self.pyspecFile.reduceFrames(reductions, reducer, memoryBudget)
         
 
 
 if __name__ == "__main__":
+    import pylab as pl
     from tools.arrayProcessing import range_to_edge
 #    data = SPE3map("/Users/raphaelproux/Desktop/PL-map/2016-05-18_1200GR_int_1s_center_wvl_935nm_Bias_-0,7V_to_0,3V_101steps_Exc_550mV_1E4_off_SIL_Sheffield_PL_Map.spe")
 #    data = SPE3map("/Users/raphaelproux/Desktop/PL-map/pol290_P=300mV_wlen=969_38 2016 May 13 19_39_35.spe")
@@ -14,8 +14,13 @@ IMPORTANT NOTE: needs the xmltodict package to work.
 If not installed install it using PIP typing "pip install xmltodict" in a terminal
 
 """
-import pylab as pl
+import numpy as np
+import os
+import time
+from numpy.lib.stride_tricks import as_strided
+from xml.etree import ElementTree
 import xmltodict
+from tools.instruments.princeton3.SPEreduce import reduceFrames, REDUCTIONS, MEMORYBUDGET
 
 class SPE3map:
 
@@ -24,13 +29,20 @@ class SPE3map:
     Reliable attributes (standardized interface): data, exposureTime, nbOfFrames, regionSize, SPEversion and wavelength.
     
     Attributes:
-        data (numpy array): numpy array containing the frames
+        data (numpy array): numpy array containing the frames (read-only view of a memory map in memmap mode)
         DATAOFFSET (int): offset to the binary data is fixed (4100 bytes) in SPE 2.X/3 file format
         dataType (short): experiment datatype (0 = float (4 bytes), 1 = long (4 bytes), 2 = short (2 bytes), 3 = unsigned short (2 bytes))
+        detTemperature (float): detector temperature set point (None if not recorded)
         exposureTime (float): exposure time of each frame in seconds
         fname (str): filename
+        footerInfo (OrderedDict): complete XML footer (parsed on first access)
+        FOOTERELEMENTS (dict): paths of the XML footer elements extracted when opening the file
         frameSize (int): size in bytes of a frame in the records
         frameStride (int): step in bytes from one record to the next
+        headerOnly (bool): if True, only the metadata was read and data is None
+        memmap (bool): if True, data is read-only views of a memory map of the file (see _readArray())
+        metaFormat (list): (name, data type, time stamp resolution or None) of each metadata recorded after the frames
+        METATYPES (dict): data types of the frames metadata
         nbOfFrames (int): number of frames recorded in the file
         regionSize (tuple): size of a frame (nb of pixels along y (1 for a simple spectrum), nb of pixels along x)
         SPEversion (float): SPE version of the file (should be 2.xxx)
@@ -49,7 +61,19 @@ class SPE3map:
     XMLFOOTEROFFSETPOS = 678  # position in bytes giving the offset to the XML footer (UnsignedInteger64)
     DATAOFFSET = 4100  # offset to the binary data is fixed (4100 bytes) in SPE 2.X/3 file format
 
-    def __init__(self, fname = None, fid = None):
+    # XML footer elements used by this class: path of the element (tags without namespace, '*' for any tag) -> name in _footerElements
+    _DEVICESPATH = ('SpeFormat', 'DataHistories', 'DataHistory', 'Origin', 'Experiment', 'Devices')
+    FOOTERELEMENTS = {('SpeFormat', 'DataFormat', 'DataBlock'): 'frameBlock',
+                      ('SpeFormat', 'DataFormat', 'DataBlock', 'DataBlock'): 'regionBlock',
+                      ('SpeFormat', 'MetaFormat', 'MetaBlock', '*'): 'metaBlock',
+                      ('SpeFormat', 'Calibrations', 'WavelengthMapping', 'Wavelength'): 'wavelength',
+                      _DEVICESPATH + ('Cameras', 'Camera', 'ShutterTiming', 'ExposureTime'): 'exposureTime',
+                      _DEVICESPATH + ('Cameras', 'Camera', 'Sensor', 'Temperature', 'SetPoint'): 'detTemperature',
+                      _DEVICESPATH + ('Spectrometers', 'Spectrometer', 'Grating', 'Selected'): 'grating',
+                      _DEVICESPATH + ('Spectrometers', 'Spectrometer', 'Grating', 'CenterWavelength'): 'centerWavelength'}
+    METATYPES = {'Int64': '<i8', 'Double': '<f8'}  # data types of the frames metadata
+
+    def __init__(self, fname = None, fid = None, memmap = False, headerOnly = False, SPEversion = None):
         """
         This function initializes the class and, if either a filename or fid is
             provided, opens the datafile and reads the contents.
@@ -57,14 +81,23 @@ class SPE3map:
         Parameters:
             fname (str, optional): Filename of SPE file
             fid (file, optional): File ID object of open stream (NOTE: never tested)
+            memmap (bool, optional): if True, data is made of read-only views of a memory map of the file
+                                     (no copy, frames are read from disk only when used).
+            headerOnly (bool, optional): if True, only the header and footer metadata are read and data is None.
+            SPEversion (float, optional): SPE version of the file if already known (read from the file if None)
         """
 
         self._fid = None
+        self.SPEversion = SPEversion
         self.fname = fname
+        self.memmap = memmap
+        self.headerOnly = headerOnly
+        self._footerInfo = None
         if fname is not None:
             self.openFile(fname)
         elif fid is not None:
             self._fid = fid
+            self._fname = self.fname = getattr(fid, 'name', None)
 
         if self._fid:
             self.readData()
@@ -72,7 +105,8 @@ class SPE3map:
 
     def readData(self):
         """Read all the data into the class"""
-        self._readSPEversion()
+        if self.SPEversion is None:
+            self._readSPEversion()
         try:
             assert(self.SPEversion >= 3)# or print 'This file is not a SPE 3.x file.'
         except:
@@ -81,14 +115,15 @@ class SPE3map:
         self._readXMLfooter()
         self._readWavelengths()
         self._readFramesInfo()
+        self._readMetaFormat()
         self._readRegionSize()
         self._readExposureTime()
-        self._readArray()
-
-        # Store other useful info
-        self.center_wavelength = int(float(self._footerInfo['SpeFormat']['DataHistories']['DataHistory']['Origin']['Experiment']['Devices']['Spectrometers']['Spectrometer']['Grating']['CenterWavelength']['#text']))
-        self.grating = self._footerInfo['SpeFormat']['DataHistories']['DataHistory']['Origin']['Experiment']['Devices']['Spectrometers']['Spectrometer']['Grating']['Selected']['#text']
-
+        self._readDetTemperature()
+        self._readGratingInfo()
+        if self.headerOnly:
+            self.data = None
+        else:
+            self._readArray()
 
     def openFile(self, fname):
         """Open a SPE file
@@ -111,88 +146,240 @@ class SPE3map:
         """
         self._fid.seek(pos)
 #        print(ntype, type(ntype), size, type(size))
-        return pl.fromfile(self._fid, ntype, int(size))
+        return np.fromfile(self._fid, ntype, int(size))
 
     def _readSPEversion(self):
         """Determines SPE file version (always there in SPE 2.x or 3.0 files)"""
-        self.SPEversion = self._readAtNumpy(self.SPEVERSIONOFFSET, 1, pl.float32)[0]
+        self.SPEversion = self._readAtNumpy(self.SPEVERSIONOFFSET, 1, np.float32)[0]
 
     def _readXMLfooter(self):
-        """Extracts the XML footer and puts it in _footerInfo as an ordered dictionnary (cf. xmltodict package)"""
-        XMLfooterPos = self._readAtNumpy(self.XMLFOOTEROFFSETPOS, 1, pl.uint64)[0]
-        self._fid.seek(XMLfooterPos)
-        self._footerInfo = xmltodict.parse(self._fid.read())
+        """Parses incrementally the XML footer and keeps only the elements listed in FOOTERELEMENTS.
+        For each name of FOOTERELEMENTS, _footerElements contains a list of (attributes dictionary, text, tag) tuples.
+        The parsing stops as soon as all the elements have been found (at the end of a section of the footer). 
+        The complete footer is only parsed when needed, see footerInfo."""
+        self._footerPos = int(self._readAtNumpy(self.XMLFOOTEROFFSETPOS, 1, np.uint64)[0])
+        self._fid.seek(self._footerPos)
+        self._footerElements = {}
+        nbOfNames = len(set(self.FOOTERELEMENTS.values()))
+        path = []
+        for event, element in ElementTree.iterparse(self._fid, events=('start', 'end')):
+            if event == 'start':
+                path.append(element.tag.rsplit('}', 1)[-1])  # remove namespace
+                continue
+            name = self.FOOTERELEMENTS.get(tuple(path), self.FOOTERELEMENTS.get(tuple(path[:-1]) + ('*',)))
+            if name is not None:
+                self._footerElements.setdefault(name, []).append((dict(element.attrib), element.text, path[-1]))
+            path.pop()
+            element.clear()
+            if len(path) == 1 and len(self._footerElements) == nbOfNames:
+                break
+
+    @property
+    def footerInfo(self):
+        """Complete XML footer as an ordered dictionnary (cf. xmltodict package). 
+        It is parsed from the file the first time it is accessed."""
+        if self._footerInfo is None:
+            with open(self._fname, 'rb') as fid:
+                fid.seek(self._footerPos)
+                self._footerInfo = xmltodict.parse(fid.read())
+        return self._footerInfo
 
     def _readWavelengths(self):
-        """Extracts the wavelength vector determined by spectrometer calibration"""
-        try:
-            wavelengthStr = self._footerInfo['SpeFormat']['Calibrations']['WavelengthMapping']['Wavelength']['#text']
-        except TypeError:  # will happen if <Wavelength> has no attributes (it happened). The ['#text'] won't exist then.
-            wavelengthStr = self._footerInfo['SpeFormat']['Calibrations']['WavelengthMapping']['Wavelength']
-        self.wavelength = pl.array([float(w) for w in wavelengthStr.split(',')])
+        """Extracts the wavelength vector determined by spectrometer calibration
+        MUST BE CALLED AFTER _readXMLfooter()"""
+        wavelengthStr = self._footerElements['wavelength'][0][1]
+        self.wavelength = np.fromstring(wavelengthStr, sep=',')
 
     def _readFramesInfo(self):
         """Extracts frames info from XML footer (number of frames, data type, frame size, frame stride)
         MUST BE CALLED AFTER _readXMLfooter()"""
-        assert(self._footerInfo['SpeFormat']['DataFormat']['DataBlock']['@type'] == 'Frame')
-        self.nbOfFrames = int(self._footerInfo['SpeFormat']['DataFormat']['DataBlock']['@count'])
-        dataTypeName = self._footerInfo['SpeFormat']['DataFormat']['DataBlock']['@pixelFormat']
-        possibleDataTypes = {'MonochromeUnsigned16': pl.uint16,
-                             'MonochromeUnsigned32': pl.uint32,
-                             'MonochromeFloat32': pl.float32,
-                             'MonochromeFloating32': pl.float32}
+        frameBlock = self._footerElements['frameBlock'][0][0]
+        assert(frameBlock['type'] == 'Frame')
+        self.nbOfFrames = int(frameBlock['count'])
+        dataTypeName = frameBlock['pixelFormat']
+        possibleDataTypes = {'MonochromeUnsigned16': np.uint16,
+                             'MonochromeUnsigned32': np.uint32,
+                             'MonochromeFloat32': np.float32,
+                             'MonochromeFloating32': np.float32}
         self.dataType = possibleDataTypes[dataTypeName]
-        self.frameSize = int(self._footerInfo['SpeFormat']['DataFormat']['DataBlock']['@size'])
-        self.frameStride = int(self._footerInfo['SpeFormat']['DataFormat']['DataBlock']['@stride'])
+        self.frameSize = int(frameBlock['size'])
+        self.frameStride = int(frameBlock['stride'])
+
+    def _readMetaFormat(self):
+        """Extracts the format of the metadata recorded after each frame (in the frame stride), in metaFormat
+        MUST BE CALLED AFTER _readXMLfooter()"""
+        self.metaFormat = []
+        for attributes, _, tag in self._footerElements.get('metaBlock', []):
+            name = attributes['event'] if tag == 'TimeStamp' else tag + attributes.get('component', '')
+            dataType = self.METATYPES.get(attributes.get('type'), '<i{}'.format(int(attributes.get('bitDepth', 64)) // 8))
+            resolution = float(attributes['resolution']) if 'resolution' in attributes else None
+            self.metaFormat.append((name, dataType, resolution))
+
+    def readFrameMetadata(self):
+        """Reads the metadata recorded by LightField after each frame (exposure time stamps, frame tracking number, 
+        gate tracking, etc.) for all the frames in one strided pass over the file.
+        
+        Returns:
+            dict: array of the values for all frames for each metadata (see metaFormat for the names). 
+                  Time stamps are converted to seconds. Empty if no metadata was recorded.
+        """
+        if not self.metaFormat:
+            return {}
+        metaDataType = np.dtype([(name, dataType) for name, dataType, _ in self.metaFormat])
+        with open(self._fname, 'rb') as fid:
+            dataBlock = np.memmap(fid, dtype=np.uint8, mode='r', offset=self.DATAOFFSET,
+                                  shape=(self.nbOfFrames * self.frameStride,))
+        records = np.ndarray((self.nbOfFrames,), dtype=metaDataType, buffer=dataBlock,
+                             offset=self.frameSize, strides=(self.frameStride,)).copy()
+        return {name: records[name] / resolution if resolution else records[name]
+                for name, _, resolution in self.metaFormat}
+
+    def findDroppedFrames(self):
+        """Finds the frames dropped during the acquisition using the frame tracking numbers.
+        
+        Returns:
+            tuple: indices of the frames after which frames are missing (numpy array), 
+                   number of missing frames after each of these frames (numpy array)
+        
+        Raises:
+            ValueError: if the frame tracking numbers were not recorded
+        """
+        metadata = self.readFrameMetadata()
+        if 'FrameTrackingNumber' not in metadata:
+            raise ValueError('The frame tracking numbers were not recorded in {}.'.format(self.fname))
+        gaps = np.diff(metadata['FrameTrackingNumber']) - 1
+        indices = np.nonzero(gaps > 0)[0]
+        return indices, gaps[indices]
 
     def _readRegionSize(self):
         """Extracts width and height of the region of interest
         MUST BE CALLED AFTER _readXMLfooter()"""
-        self.roi_data = self._footerInfo['SpeFormat']['DataFormat']['DataBlock']['DataBlock']
-        if type(self.roi_data) == list:
+        self.roi_data = [element[0] for element in self._footerElements['regionBlock']]
+        if len(self.roi_data) > 1:
             self.regionSize = list()
             self.n_roi = len(self.roi_data)
             for ROI in self.roi_data:
-                self.regionSize.append((int(ROI['@height']), int(ROI['@width'])))
+                self.regionSize.append((int(ROI['height']), int(ROI['width'])))
             print(self.regionSize)
         else:
-            assert(self.roi_data['@type'] == 'Region')
-            height = int(self.roi_data['@height'])
-            width = int(self.roi_data['@width'])
+            self.roi_data = self.roi_data[0]
+            assert(self.roi_data['type'] == 'Region')
+            height = int(self.roi_data['height'])
+            width = int(self.roi_data['width'])
             self.regionSize = (height,width)
         
     def _readExposureTime(self):
         """Extracts the camera exposure time
         MUST BE CALLED AFTER _readXMLfooter()"""
-        self.exposureTime = float(self._footerInfo['SpeFormat']['DataHistories']['DataHistory']['Origin']['Experiment']['Devices']['Cameras']['Camera']['ShutterTiming']['ExposureTime']['#text'])
+        self.exposureTime = float(self._footerElements['exposureTime'][0][1])
+
+    def _readDetTemperature(self):
+        """Extracts the detector temperature set point (None if not in the footer)
+        MUST BE CALLED AFTER _readXMLfooter()"""
+        if 'detTemperature' in self._footerElements:
+            self.detTemperature = float(self._footerElements['detTemperature'][0][1])
+        else:
+            self.detTemperature = None
+
+    def _readGratingInfo(self):
+        """Extracts the selected grating and the central wavelength of the spectrometer
+        MUST BE CALLED AFTER _readXMLfooter()"""
+        self.center_wavelength = int(float(self._footerElements['centerWavelength'][0][1]))
+        self.grating = self._footerElements['grating'][0][1]
+        
+    def _mapRegions(self, fid):
+        """Maps the data block of the file in memory (read-only) and returns a strided view 
+        (following frameStride) for each region of interest.
+        MUST BE CALLED AFTER _readFramesInfo() and _readRegionSize()
         
+        Args:
+            fid (file): file object of the SPE file
+        
+        Returns:
+            list: numpy arrays (nb of frames, nb of pixels along y, nb of pixels along x), one per region
+        """
+        itemSize = np.dtype(self.dataType).itemsize
+        dataBlock = np.memmap(fid, dtype=np.uint8, mode='r', offset=self.DATAOFFSET,
+                              shape=((self.nbOfFrames - 1) * self.frameStride + self.frameSize,))
+
+        regionSizes = self.regionSize if type(self.regionSize) == list else [self.regionSize]
+        regions = []
+        regionOffset = 0  # offset in bytes of the region in a frame
+        for height, width in regionSizes:
+            regionNbytes = height * width * itemSize
+            regionBytes = dataBlock[regionOffset:regionOffset + (self.nbOfFrames - 1) * self.frameStride + regionNbytes]
+            regions.append(as_strided(regionBytes.view(self.dataType),
+                                      shape=(self.nbOfFrames, height, width),
+                                      strides=(self.frameStride, width * itemSize, itemSize),
+                                      writeable=False))
+            regionOffset += regionNbytes
+        return regions
+
     def _readArray(self):
-        """Reads the binary data contained in the file"""
+        """Reads the binary data contained in the file.
+        Each region of interest is a strided view of a memory map of the data block (see _mapRegions()),
+        which is copied to memory only if not in memmap mode.
+        MUST BE CALLED AFTER _readFramesInfo() and _readRegionSize()"""
+        regions = [region if self.memmap else np.array(region) for region in self._mapRegions(self._fid)]
         if type(self.regionSize) == list:
-            multi_roi = True
-            self.data = {('r'+str(i)):[] for i in range(len(self.regionSize)) }
+            self.data = {('r' + str(i)): region for i, region in enumerate(regions)}
         else:
-            multi_roi = False
-            self.data = []
-
-        for frameNb in range(self.nbOfFrames):
-            frameData = self._readAtNumpy(self.DATAOFFSET + frameNb * self.frameStride, self.frameSize / self.dataType().nbytes, self.dataType)
-            if multi_roi:
-                val_count = 0
-                for idx_ROI, ROI in enumerate(self.regionSize):
-                    roi_size = pl.array(self.regionSize[idx_ROI])
-                    roi_n_vals = pl.prod(roi_size)
-                    roi_name = 'r' + str(idx_ROI)
- 
-                    self.data[roi_name].append(frameData[val_count:(val_count+roi_n_vals)]\
-                            .reshape(roi_size))
-                    val_count += roi_n_vals
-            else:
-                self.data.append(frameData.reshape(self.regionSize))
-        if multi_roi:
-            self.data = {k: pl.array(v) for k, v in self.data.items()}
-        else:
-            self.data = pl.array(self.data)
+            self.data = regions[0]
+
+    def readFrames(self, start=0, stop=None, step=1, roi=None):
+        """Reads a range of frames, possibly restricted to a window of pixels. Only the requested frames
+        and pixels are read from the disk (even in header-only mode), the other frames are not loaded.
+        
+        Args:
+            start (int, optional): index of the first frame
+            stop (int, optional): index after the last frame (until the end of the file if None)
+            step (int, optional): step between the frames
+            roi (tuple, optional): pixel window (y0, y1, x0, x1), same meaning as slice indices. All pixels if None.
+        
+        Returns:
+            numpy array or dict: contiguous array of the frames (nb of frames, nb of pixels along y, nb of pixels along x).
+                                 For multiple regions of interest, dictionary of such arrays (same keys as data).
+        """
+        window = (slice(start, stop, step),)
+        if roi is not None:
+            window += (slice(roi[0], roi[1]), slice(roi[2], roi[3]))
+
+        data = self._dataOrMap()
+        if type(data) == dict:
+            return {name: np.array(region[window]) for name, region in data.items()}
+        return np.array(data[window])
+
+    def reduceFrames(self, reductions=REDUCTIONS, reducer=None, memoryBudget=MEMORYBUDGET):
+        """Computes reductions over all the frames in one pass, streaming the frames from the file 
+        in chunks which fit in memoryBudget (see SPEreduce.reduceFrames()).
+        
+        Args:
+            reductions (iterable, optional): reductions to compute among 'sum', 'mean', 'max', 'min' and 'var'
+            reducer (function, optional): user reduction called as accumulator = reducer(chunk, accumulator)
+            memoryBudget (int, optional): working memory allowed for a chunk of frames, in bytes
+        
+        Returns:
+            dict: result of each reduction (frame-shaped arrays), the result of reducer is under 'reducer'.
+                  For multiple regions of interest, dictionary of such results (same keys as data).
+        """
+        data = self._dataOrMap()
+        if type(data) == dict:
+            return {name: reduceFrames(region, reductions, reducer, memoryBudget) for name, region in data.items()}
+        return reduceFrames(data, reductions, reducer, memoryBudget)
+
+    def _dataOrMap(self):
+        """Returns data, or the strided views of a memory map of the file in header-only mode (same structure as data).
+        
+        Returns:
+            numpy array or dict: frames of the file (dictionary of frames for each region if multiple regions of interest)
+        """
+        if self.data is not None:
+            return self.data
+        with open(self._fname, 'rb') as fid:
+            regions = self._mapRegions(fid)
+        if type(self.regionSize) == list:
+            return {('r' + str(i)): region for i, region in enumerate(regions)}
+        return regions[0]
         
     def saveXMLinfo(self, filePath):
         """allows the user to save the XML footer to a file of his choice
@@ -201,14 +388,138 @@ class SPE3map:
             filePath (str): filename of the XML file where to save the header.
         """
         text_file = open(filePath, "w")
-        text_file.write(xmltodict.unparse(self._footerInfo))
+        text_file.write(xmltodict.unparse(self.footerInfo))
         text_file.close()
 
 
+class SPE3follower:
+
+    """Class which follows a SPE3 file while LightField is writing it, to monitor an acquisition in near real time.
+
+    As long as the XML footer is not written, the frames layout is deduced from the legacy header fields 
+    (xdim, ydim, datatype) and the number of complete frames from the file size and frameStride.
+    Once the footer is written, the exact metadata is read (see SPE3map attribute) and the remaining frames are returned.
+
+    Attributes:
+        dataType (numpy data type): data type of the pixels
+        finished (bool): True once the footer has been written and all the frames have been returned
+        fname (str): filename
+        frameSize (int): size in bytes of a frame in the records
+        frameStride (int): step in bytes from one record to the next
+        HEADERDTYPE (numpy dtype): structured data type of the header fields used before the footer is written
+        nbOfFrames (int): number of frames returned so far
+        regionSize (tuple or list): size of a frame (nb of pixels along y, nb of pixels along x), list for multiple regions
+        SPE3map (SPE3map object): header-only SPE3map of the finished file (None until the footer is written)
+    """
+
+    HEADERDTYPE = np.dtype({'names': ['xdim', 'datatype', 'ydim', 'XMLfooterPos'],
+                            'formats': ['<u2', '<i2', '<u2', '<u8'],
+                            'offsets': [42, 108, 656, SPE3map.XMLFOOTEROFFSETPOS],
+                            'itemsize': SPE3map.DATAOFFSET})
+    DATATYPES = {0: np.float32, 1: np.int32, 2: np.int16, 3: np.uint16, 8: np.uint32}  # legacy header data types
+
+    def __init__(self, fname, frameStride=None):
+        """
+        Parameters:
+            fname (str): Filename of the SPE3 file being written
+            frameStride (int, optional): step in bytes from one record to the next before the footer is written. 
+                                         Give it if LightField records metadata after each frame (frame size if None).
+        """
+        self.fname = fname
+        self.frameStride = frameStride
+        self.nbOfFrames = 0
+        self.finished = False
+        self.SPE3map = None
+        self.regionSize = None
+
+    def _readHeader(self):
+        """Reads the header fields used to follow the file and deduces the frames layout from them
+        (until the footer is written).
+
+        Returns:
+            numpy record or None: header fields (see HEADERDTYPE), None if the header is not written yet.
+        """
+        if not os.path.exists(self.fname):
+            return None
+        with open(self.fname, 'rb') as fid:
+            header = np.fromfile(fid, self.HEADERDTYPE, 1)
+        if len(header) == 0:
+            return None
+        header = header[0]
+        if self.regionSize is None:
+            self.regionSize = (int(header['ydim']), int(header['xdim']))
+            self.dataType = self.DATATYPES[int(header['datatype'])]
+            self.frameSize = int(np.prod(self.regionSize)) * np.dtype(self.dataType).itemsize
+            if self.frameStride is None:
+                self.frameStride = self.frameSize
+        return header
+
+    def poll(self):
+        """Returns the frames completely written since the last call.
+
+        Returns:
+            numpy array or dict: new frames (nb of new frames, nb of pixels along y, nb of pixels along x), possibly empty.
+                                 Once the footer is written, dictionary of such arrays for multiple regions of interest.
+        """
+        if self.finished:
+            return self.SPE3map.readFrames(self.nbOfFrames)  # no new frame (dictionary for multiple regions of interest)
+        header = self._readHeader()
+        if header is None:
+            return np.empty((0,) + (self.regionSize or (0, 0)))
+
+        if header['XMLfooterPos'] != 0:
+            self.SPE3map = SPE3map(self.fname, headerOnly=True)
+            for attribute in ('regionSize', 'dataType', 'frameSize', 'frameStride'):
+                setattr(self, attribute, getattr(self.SPE3map, attribute))
+            self.finished = True
+            newFrames = self.SPE3map.readFrames(self.nbOfFrames)
+            self.nbOfFrames = self.SPE3map.nbOfFrames
+            return newFrames
+
+        dataNbytes = os.path.getsize(self.fname) - SPE3map.DATAOFFSET
+        nbOfFrames = max(0, (dataNbytes - self.frameSize) // self.frameStride + 1)
+        nbOfNewFrames = nbOfFrames - self.nbOfFrames
+        if nbOfNewFrames <= 0:
+            return np.empty((0,) + self.regionSize, dtype=self.dataType)
+
+        with open(self.fname, 'rb') as fid:
+            fid.seek(SPE3map.DATAOFFSET + self.nbOfFrames * self.frameStride)
+            newBytes = np.fromfile(fid, np.uint8, (nbOfNewFrames - 1) * self.frameStride + self.frameSize)
+        itemSize = np.dtype(self.dataType).itemsize
+        newFrames = as_strided(newBytes[:newBytes.size - newBytes.size % itemSize].view(self.dataType),
+                               shape=(nbOfNewFrames,) + self.regionSize,
+                               strides=(self.frameStride, self.regionSize[1] * itemSize, itemSize))
+        self.nbOfFrames = nbOfFrames
+        return np.array(newFrames)
+
+    def follow(self, pollInterval=0.5, timeout=None):
+        """Generator which yields the new frames as they are written, until the footer is written.
+
+        Args:
+            pollInterval (float, optional): time in seconds between two checks of the file
+            timeout (float, optional): stop if no new frame is written for timeout seconds (never stops if None)
+
+        Yields:
+            numpy array or dict: new frames (see poll())
+        """
+        lastFrameTime = time.time()
+        while True:
+            newFrames = self.poll()
+            if len(newFrames) > 0:
+                lastFrameTime = time.time()
+                yield newFrames
+            if self.finished:
+                return
+            if timeout is not None and time.time() - lastFrameTime > timeout:
+                return
+            time.sleep(pollInterval)
+
+
 if __name__ == "__main__":
+    import pylab as pl
     from tkinter.filedialog import askopenfilename
     from tools.arrayProcessing import range_to_edge, filter_cosmic_rays
-    import glob, os
+    import glob
 
     os.chdir(r"/Users/raphaelproux/Desktop/mocvd-wse2/170904-4K-good-map/power-dep/")
     pl.figure()
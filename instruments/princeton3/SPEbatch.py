@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+This library loads a batch of SPE files (SPE2 or SPE3, see SPEread.openSPE()) in parallel.
+Each file is reduced (first frame, sum of frames or any picklable function) inside the workers
+so that only small results are sent back, and the results are stacked in one array.
+
+Example (power dependence folder):
+    spectra, metadata = loadSPEbatch('power-dep/*.spe', reduction='frame0')
+    powers = [float(os.path.splitext(os.path.basename(m['fname']))[0]) for m in metadata]
+
+This is a python 3 library.
+"""
+
+import numpy as np
+import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from tools.instruments.princeton3.SPEread import openSPE
+
+
+def _loadFile(args):
+    """Opens a SPE file and reduces it (executed by the workers of loadSPEbatch()).
+
+    Args:
+        args (tuple): filename and reduction (see loadSPEbatch())
+
+    Returns:
+        tuple: result of the reduction, metadata dictionary of the file
+    """
+    fname, reduction = args
+    spe = openSPE(fname, memmap=True)
+    if reduction is None:
+        result = spe.readFrames()
+    elif reduction == 'frame0':
+        result = spe.readFrames(0, 1)
+        result = {name: frames[0] for name, frames in result.items()} if type(result) == dict else result[0]
+    elif reduction == 'sum':
+        result = spe.reduceFrames(('sum',))
+        result = {name: sums['sum'] for name, sums in result.items()} if 'sum' not in result else result['sum']
+    else:
+        result = reduction(spe)
+
+    metadata = {'fname': fname,
+                'SPEversion': float(spe.SPEversion),
+                'nbOfFrames': int(spe.nbOfFrames),
+                'regionSize': spe.regionSize,
+                'exposureTime': float(spe.exposureTime),
+                'wavelength': spe.wavelength}
+    return result, metadata
+
+
+def loadSPEbatch(patterns, reduction='frame0', workers=None, useThreads=False):
+    """Loads in parallel all the SPE files matching patterns and stacks the reduced data of the files in one array.
+    Files with a result incompatible with the first one (different shape or data type which cannot be cast,
+    or multiple regions of interest) are not stacked, their result is kept in their metadata under 'result'.
+
+    Args:
+        patterns (str or list): glob pattern(s) of the files to load (e.g. 'power-dep/*.spe')
+        reduction (str or function, optional): reduction applied to each file inside the workers:
+                                               'frame0' (first frame), 'sum' (sum of all frames), None (all frames)
+                                               or a function taking the SPE map object and returning a numpy array
+                                               (must be picklable, i.e. defined at module level, if useThreads is False)
+        workers (int, optional): number of workers (number of processors if None)
+        useThreads (bool, optional): use a pool of threads instead of a pool of processes
+
+    Returns:
+        tuple: stacked results (numpy array, one row per stacked file), list of metadata dictionaries
+               (one per file, in the order of the sorted filenames) with keys fname, SPEversion, nbOfFrames,
+               regionSize, exposureTime, wavelength and stackIndex (row in the stacked results, None if not stacked)
+    """
+    if type(patterns) == str:
+        patterns = [patterns]
+    fnames = sorted(set(fname for pattern in patterns for fname in glob.glob(pattern)))
+
+    stack = None
+    nbOfStackedFiles = 0
+    metadata = []
+    executorClass = ThreadPoolExecutor if useThreads else ProcessPoolExecutor
+    with executorClass(max_workers=workers) as executor:
+        for result, fileMetadata in executor.map(_loadFile, [(fname, reduction) for fname in fnames]):
+            if stack is None and isinstance(result, np.ndarray):
+                stack = np.empty((len(fnames),) + result.shape, dtype=result.dtype)
+            if (isinstance(result, np.ndarray) and result.shape == stack.shape[1:]
+                    and np.can_cast(result.dtype, stack.dtype)):
+                stack[nbOfStackedFiles] = result
+                fileMetadata['stackIndex'] = nbOfStackedFiles
+                nbOfStackedFiles += 1
+            else:
+                fileMetadata['stackIndex'] = None
+                fileMetadata['result'] = result
+            metadata.append(fileMetadata)
+
+    if stack is None:
+        stack = np.empty((0,))
+    return stack[:nbOfStackedFiles], metadata
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+Benchmarks of the SPE reading libraries on synthetic files (see SPEwrite).
+Run this file directly to execute all the benchmarks.
+
+This is a python 3 library.
+"""
+
+import pylab as pl
+import os
+import tempfile
+import time
+from tools.instruments.princeton3.SPE2read import SPE2file
+from tools.instruments.princeton3.SPE3read import SPE3map
+from tools.instruments.princeton3.SPEwrite import writeSPE2file, writeSPE3file
+
+
+def _timeIt(func, args):
+    """Calls func on each element of args and returns the total time taken.
+
+    Args:
+        func (function): function to call with one argument
+        args (iterable): arguments on which to call func
+
+    Returns:
+        float: total time in seconds
+    """
+    startTime = time.perf_counter()
+    for arg in args:
+        func(arg)
+    return time.perf_counter() - startTime
+
+
+def _readHeaderFieldByField(fname):
+    """Reads the SPE2 header one field at a time with a seek and fromfile for each field
+    (reading pattern of SPE2file before the header was decoded in one go). Used as a reference.
+
+    Args:
+        fname (str): path to the SPE2 file
+
+    Returns:
+        dict: header fields
+    """
+    header = {}
+    with open(fname, 'rb') as fid:
+        for name, (fieldType, offset) in SPE2file.HEADERDTYPE.fields.items():
+            fid.seek(offset)
+            header[name] = pl.fromfile(fid, fieldType, 1)[0]
+    return header
+
+
+def benchmarkHeaderRead(nbOfFiles=1000, nbOfFrames=100, nbOfPixels=1340, folder=None):
+    """Compares the time needed to scan the headers of a directory of synthetic SPE2 files
+    with the field by field reading, the full opening and the header-only opening of SPE2file.
+
+    Args:
+        nbOfFiles (int, optional): number of files to generate
+        nbOfFrames (int, optional): number of frames in each file
+        nbOfPixels (int, optional): number of pixels in each frame
+        folder (str, optional): folder where to generate the files (temporary folder if None)
+
+    Returns:
+        dict: total time in seconds for each method
+    """
+    with tempfile.TemporaryDirectory(dir=folder) as tempFolder:
+        fnames = [os.path.join(tempFolder, 'spectrum{}.spe'.format(i)) for i in range(nbOfFiles)]
+        data = pl.randint(0, 65535, (nbOfFrames, 1, nbOfPixels)).astype(pl.uint16)
+        for fname in fnames:
+            writeSPE2file(fname, data)
+
+        results = {'field by field': _timeIt(_readHeaderFieldByField, fnames),
+                   'full open': _timeIt(SPE2file, fnames),
+                   'header only': _timeIt(lambda fname: SPE2file(fname, headerOnly=True), fnames)}
+
+    print('SPE2 header scan of {} files ({} frames of {} pixels):'.format(nbOfFiles, nbOfFrames, nbOfPixels))
+    for method, duration in results.items():
+        print('    {:<15}: {:8.3f} s ({:.1f} us/file)'.format(method, duration, duration / nbOfFiles * 1e6))
+    return results
+
+
+def benchmarkHDF5(nbOfFrames=5000, nbOfPixels=1340, nbOfFramesRead=200, compressions=('gzip', 'lzf'), folder=None):
+    """Compares a synthetic SPE3 file (Poisson noise on a background, like a real spectrum) with its HDF5
+    conversions: time to open the file, time to read random frames and size on disk.
+
+    Args:
+        nbOfFrames (int, optional): number of frames in the file
+        nbOfPixels (int, optional): number of pixels in each frame
+        nbOfFramesRead (int, optional): number of random frames read for the frame read time
+        compressions (tuple, optional): HDF5 compressions to test (see SPEhdf5.convertSPEtoHDF5())
+        folder (str, optional): folder where to generate the files (temporary folder if None)
+
+    Returns:
+        dict: for each format, dictionary of open time (s), frame read time (s/frame) and size (bytes)
+    """
+    from tools.instruments.princeton3.SPEhdf5 import convertSPEtoHDF5, SPEhdf5map
+
+    frameIndices = pl.randint(0, nbOfFrames, nbOfFramesRead)
+    results = {}
+    with tempfile.TemporaryDirectory(dir=folder) as tempFolder:
+        speFname = os.path.join(tempFolder, 'map.spe')
+        background = 600 + 400 * pl.exp(-((pl.arange(nbOfPixels) - nbOfPixels / 2) / 50.)**2)
+        writeSPE3file(speFname, pl.poisson(background, (nbOfFrames, 1, nbOfPixels)).astype(pl.uint16))
+
+        readers = {'SPE (loaded)': (speFname, SPE3map),
+                   'SPE (memmap)': (speFname, lambda fname: SPE3map(fname, memmap=True))}
+        for compression in compressions:
+            hdf5Fname = os.path.join(tempFolder, 'map-{}.hdf5'.format(compression))
+            startTime = time.perf_counter()
+            convertSPEtoHDF5(speFname, hdf5Fname, compression=compression)
+            print('Conversion to HDF5 ({}): {:.3f} s'.format(compression, time.perf_counter() - startTime))
+            readers['HDF5 ({})'.format(compression)] = (hdf5Fname, SPEhdf5map)
+
+        for name, (fname, reader) in readers.items():
+            openTime = _timeIt(reader, [fname])
+            spe = reader(fname)
+            readTime = _timeIt(lambda index, spe=spe: spe.readFrames(index, index + 1), frameIndices) / nbOfFramesRead
+            results[name] = {'open time': openTime, 'frame read time': readTime, 'size': os.path.getsize(fname)}
+            if hasattr(spe, 'close'):
+                spe.close()
+            del spe  # release the memory maps before the temporary folder is removed
+
+    print('SPE3 file of {} frames of {} pixels:'.format(nbOfFrames, nbOfPixels))
+    for name, result in results.items():
+        print('    {:<14}: open {:8.4f} s, frame read {:8.1f} us, size {:8.2f} MB'.format(
+            name, result['open time'], result['frame read time'] * 1e6, result['size'] / 2.**20))
+    return results
+
+
+if __name__ == "__main__":
+    benchmarkHeaderRead()
+    benchmarkHDF5()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+This library maintains a SQLite catalog of the metadata of SPE files (SPE2 and SPE3) found in a folder tree,
+so that files can be searched (grating, center wavelength, exposure time, etc.) without opening them.
+The catalog is updated incrementally: only new or modified files (different size or modification time) are read.
+
+Example:
+    catalog = SPEcatalog('spectra.sqlite')
+    catalog.update('/data/bay3')
+    spectra = catalog.query(grooves=1200, centerWavelength=935, exposureTime=1000)
+
+This is a python 3 library.
+"""
+
+import os
+import re
+import sqlite3
+from tools.instruments.princeton3.SPEread import openSPE
+
+
+class SPEcatalog:
+
+    """Class which handles a SQLite catalog of SPE files metadata.
+
+    Attributes:
+        COLUMNS (tuple): (name, SQL type) of the columns of the catalog table
+        dbPath (str): path to the SQLite database file
+        EXTENSIONS (tuple): extensions (lower case) of the files to index
+    """
+
+    COLUMNS = (('path', 'TEXT PRIMARY KEY'),
+               ('size', 'INTEGER'),
+               ('mtime', 'REAL'),
+               ('SPEversion', 'REAL'),
+               ('nbOfFrames', 'INTEGER'),
+               ('nbOfRegions', 'INTEGER'),
+               ('regionHeight', 'INTEGER'),  # size of the first region of interest
+               ('regionWidth', 'INTEGER'),
+               ('exposureTime', 'REAL'),
+               ('grating', 'TEXT'),
+               ('grooves', 'REAL'),
+               ('centerWavelength', 'REAL'),
+               ('detTemperature', 'REAL'),
+               ('wavelengthMin', 'REAL'),
+               ('wavelengthMax', 'REAL'),
+               ('error', 'TEXT'))  # error message if the file could not be read
+    EXTENSIONS = ('.spe',)
+
+    def __init__(self, dbPath):
+        """Opens (and creates if needed) the catalog database.
+
+        Args:
+            dbPath (str): path to the SQLite database file
+        """
+        self.dbPath = dbPath
+        self._connection = sqlite3.connect(dbPath)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS spe ({})'.format(
+            ', '.join('{} {}'.format(name, sqlType) for name, sqlType in self.COLUMNS)))
+        self._connection.commit()
+
+    def close(self):
+        """Closes the database."""
+        self._connection.close()
+
+    def _readMetadata(self, path):
+        """Reads the metadata of a SPE file (header and footer only).
+
+        Args:
+            path (str): path to the SPE file
+
+        Returns:
+            dict: value of each column (except path, size and mtime)
+        """
+        try:
+            spe = openSPE(path, headerOnly=True)
+        except Exception as error:
+            return {'error': '{}: {}'.format(type(error).__name__, error)}
+
+        regionSizes = spe.regionSize if type(spe.regionSize) == list else [spe.regionSize]
+        metadata = {'SPEversion': float(spe.SPEversion),
+                    'nbOfFrames': int(spe.nbOfFrames),
+                    'nbOfRegions': len(regionSizes),
+                    'regionHeight': int(regionSizes[0][0]),
+                    'regionWidth': int(regionSizes[0][1]),
+                    'exposureTime': float(spe.exposureTime),
+                    'wavelengthMin': float(spe.wavelength.min()),
+                    'wavelengthMax': float(spe.wavelength.max())}
+        if hasattr(spe, 'pyspecFile'):  # SPE2map
+            metadata['grooves'] = float(spe.pyspecFile.SpecGrooves)
+            metadata['centerWavelength'] = float(spe.pyspecFile.SpecCenterWlNm)
+            metadata['detTemperature'] = float(spe.pyspecFile.DetTemperature)
+        else:
+            grooves = re.search(r'\[[^,\]]*,\s*([0-9.]+)\]', spe.grating or '')
+            metadata['grating'] = spe.grating
+            metadata['grooves'] = float(grooves.group(1)) if grooves else None
+            metadata['centerWavelength'] = float(spe.center_wavelength)
+            metadata['detTemperature'] = spe.detTemperature
+        return metadata
+
+    def update(self, rootFolder, removeMissing=True):
+        """Indexes the SPE files found in rootFolder and its subfolders.
+        Files already in the catalog with the same size and modification time are not read again.
+
+        Args:
+            rootFolder (str): folder to index
+            removeMissing (bool, optional): remove from the catalog the files of rootFolder which do not exist anymore
+
+        Returns:
+            tuple: number of files (re)indexed, number of files removed from the catalog
+        """
+        rootFolder = os.path.abspath(rootFolder)
+        prefix = os.path.join(rootFolder, '')  # exact prefix (LIKE would treat _ and % as wildcards and ignore the case)
+        known = {path: (size, mtime) for path, size, mtime in self._connection.execute(
+            'SELECT path, size, mtime FROM spe WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))}
+
+        columnNames = [name for name, _ in self.COLUMNS]
+        rows = []
+        found = set()
+        for folder, _, filenames in os.walk(rootFolder):
+            for filename in filenames:
+                if os.path.splitext(filename)[1].lower() not in self.EXTENSIONS:
+                    continue
+                path = os.path.join(folder, filename)
+                stat = os.stat(path)
+                found.add(path)
+                if known.get(path) == (stat.st_size, stat.st_mtime):
+                    continue
+                row = self._readMetadata(path)
+                row.update(path=path, size=stat.st_size, mtime=stat.st_mtime)
+                rows.append([row.get(name) for name in columnNames])
+
+        self._connection.executemany('INSERT OR REPLACE INTO spe VALUES ({})'.format(', '.join('?' * len(columnNames))), rows)
+        missing = [(path,) for path in known if path not in found] if removeMissing else []
+        self._connection.executemany('DELETE FROM spe WHERE path = ?', missing)
+        self._connection.commit()
+        return len(rows), len(missing)
+
+    def query(self, **criteria):
+        """Searches the catalog (no SPE file is opened).
+
+        Args:
+            **criteria: column name = value. The value can be a number or a string (equality, strings containing %
+                        are matched with LIKE) or a (min, max) tuple (either can be None for an open range).
+                        Example: query(grooves=1200, centerWavelength=(930, 940), exposureTime=1000)
+
+        Returns:
+            list: dictionaries of the metadata of the matching files (keys are the column names), sorted by path
+
+        Raises:
+            ValueError: if a criterion is not a column of the catalog
+        """
+        columnNames = [name for name, _ in self.COLUMNS]
+        conditions = []
+        parameters = []
+        for name, value in criteria.items():
+            if name not in columnNames:
+                raise ValueError('{} is not a column of the catalog.'.format(name))
+            if type(value) == tuple:
+                if value[0] is not None:
+                    conditions.append('{} >= ?'.format(name))
+                    parameters.append(value[0])
+                if value[1] is not None:
+                    conditions.append('{} <= ?'.format(name))
+                    parameters.append(value[1])
+            elif type(value) == str and '%' in value:
+                conditions.append('{} LIKE ?'.format(name))
+                parameters.append(value)
+            else:
+                conditions.append('{} = ?'.format(name))
+                parameters.append(value)
+
+        request = 'SELECT * FROM spe'
+        if conditions:
+            request += ' WHERE ' + ' AND '.join(conditions)
+        request += ' ORDER BY path'
+        return [dict(zip(columnNames, row)) for row in self._connection.execute(request, parameters)]
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+This library exports a selection of frames of a SPE file (SPE2 or SPE3, see SPEread.openSPE()) in one pass
+to a text (CSV, TSV, TXT), numpy (.npy, .npz) or HDF5 file. The frames are read and written chunk by chunk,
+so that only the selected frames are read and the file never needs to be in memory all at once.
+
+Text files contain one line per spectrum (one line per row of pixels for images): the frame index
+(and the row index for images) followed by the pixel values. The first line is a commented header
+with the wavelengths, so that the files can be loaded with numpy.loadtxt(fname, delimiter=...).
+
+Example (every 10th frame of a map to CSV):
+    exportFrames('map.spe', 'map.csv', frames='0::10')
+
+This is a python 3 library.
+"""
+
+import numpy as np
+import os
+import zipfile
+from numpy.lib import format as npyFormat
+from tools.instruments.princeton3.SPEread import openSPE
+from tools.instruments.princeton3.SPEreduce import MEMORYBUDGET
+
+DELIMITERS = {'.csv': ',', '.tsv': '\t', '.txt': ' ', '.dat': ' '}  # text file extension: delimiter
+BINARYEXTENSIONS = ('.npy', '.npz', '.hdf5', '.h5')
+TEXTBYTESPERVALUE = 64  # working memory needed to format one value to text (python objects and string)
+
+
+def parseFrameSelection(selection, nbOfFrames):
+    """Converts a frame selection string to the range of the selected frame indices.
+
+    Args:
+        selection (str or int): frame index ('12', negative indices count from the end), slice ('start:stop:step' with
+                                a positive step, e.g. '100:200', '0::10', ':-1') or 'all'. None selects all the frames.
+        nbOfFrames (int): number of frames in the file
+
+    Returns:
+        range: indices of the selected frames
+
+    Raises:
+        ValueError: if the selection cannot be understood or selects no frame
+    """
+    if selection is None or str(selection).strip().lower() == 'all':
+        return range(nbOfFrames)
+    try:
+        parts = [int(part) if part.strip() else None for part in str(selection).split(':')]
+    except ValueError:
+        raise ValueError('Invalid frame selection {!r} (expected index, start:stop:step or all).'.format(selection))
+    if len(parts) == 1:
+        index = parts[0] + nbOfFrames if parts[0] < 0 else parts[0]
+        frameIndices = range(nbOfFrames)[index:index + 1]
+    elif len(parts) <= 3:
+        frameIndices = range(nbOfFrames)[slice(*parts)]
+    else:
+        raise ValueError('Invalid frame selection {!r} (expected index, start:stop:step or all).'.format(selection))
+    if frameIndices.step < 0:
+        raise ValueError('The frame selection {!r} has a negative step, frames are exported in increasing order.'.format(selection))
+    if len(frameIndices) == 0:
+        raise ValueError('The frame selection {!r} selects no frame out of {}.'.format(selection, nbOfFrames))
+    return frameIndices
+
+
+def _iterChunks(spe, frameIndices, nbOfFramesPerChunk):
+    """Reads the selected frames chunk by chunk (only the selected frames are read).
+
+    Args:
+        spe (SPE2map, SPE3map or SPEhdf5map): opened SPE file
+        frameIndices (range): indices of the frames to read
+        nbOfFramesPerChunk (int): number of frames per chunk
+
+    Yields:
+        tuple: indices of the frames in the chunk (range), dictionary of frames arrays for each region
+               (key '' for a single region)
+    """
+    for chunkStart in range(0, len(frameIndices), nbOfFramesPerChunk):
+        chunkIndices = frameIndices[chunkStart:chunkStart + nbOfFramesPerChunk]
+        frames = spe.readFrames(chunkIndices.start, chunkIndices.stop, chunkIndices.step)
+        yield chunkIndices, frames if type(frames) == dict else {'': frames}
+
+
+def _valueFormat(dataType):
+    """Returns the printf-style format of a pixel value: integers are written exactly, floats with enough digits
+    to be read back identically.
+
+    Args:
+        dataType (numpy data type): data type of the pixels
+
+    Returns:
+        str: format of one value
+    """
+    if np.issubdtype(dataType, np.integer):
+        return '%d'
+    return '%.9g' if np.dtype(dataType).itemsize <= 4 else '%.17g'
+
+
+def _textHeader(wavelength, regionSize, delimiter):
+    """Returns the commented header line of a text export (column names, the wavelengths for the pixels).
+
+    Args:
+        wavelength (numpy array): wavelengths (pixel indices are used if it does not match the width of the frames)
+        regionSize (tuple): size of a frame (nb of pixels along y, nb of pixels along x)
+        delimiter (str): delimiter between the values
+
+    Returns:
+        str: header line
+    """
+    indexColumns = ['frame'] if regionSize[0] == 1 else ['frame', 'row']
+    if len(wavelength) == regionSize[1]:
+        pixelColumns = [repr(float(w)) for w in wavelength]
+    else:
+        pixelColumns = [str(i) for i in range(regionSize[1])]
+    return '# ' + delimiter.join(indexColumns + pixelColumns) + '\n'
+
+
+def _textLineFormat(regionSize, dataType, delimiter):
+    """Returns the format of a line of a text export (frame index, row index for images, pixel values).
+
+    Args:
+        regionSize (tuple): size of a frame (nb of pixels along y, nb of pixels along x)
+        dataType (numpy data type): data type of the pixels
+        delimiter (str): delimiter between the values
+
+    Returns:
+        str: format of one line, including the end of line
+    """
+    nbOfIndexColumns = 1 if regionSize[0] == 1 else 2
+    return delimiter.join(['%d'] * nbOfIndexColumns + [_valueFormat(dataType)] * regionSize[1]) + '\n'
+
+
+def _formatTextChunk(chunkIndices, frames, lineFormat):
+    """Formats a chunk of frames to text with a single string formatting operation.
+
+    Args:
+        chunkIndices (range): indices of the frames in the chunk
+        frames (numpy array): frames (nb of frames, nb of pixels along y, nb of pixels along x)
+        lineFormat (str): format of a line (see _textLineFormat())
+
+    Returns:
+        str: lines of the chunk
+    """
+    nbOfFrames, height, width = frames.shape
+    nbOfIndexColumns = 1 if height == 1 else 2
+    rows = np.empty((nbOfFrames, height, nbOfIndexColumns + width), dtype=np.result_type(frames.dtype, np.int64))
+    rows[:, :, 0] = np.asarray(chunkIndices)[:, None]
+    if height > 1:
+        rows[:, :, 1] = np.arange(height)
+    rows[:, :, nbOfIndexColumns:] = frames
+    return (lineFormat * (nbOfFrames * height)) % tuple(rows.ravel().tolist())
+
+
+def _writeNpyHeader(fid, shape, dataType):
+    """Writes the header of a .npy file, the raw data (C order) has to be written after it.
+
+    Args:
+        fid (file object): binary file (or file in a zip archive) opened for writing
+        shape (tuple): shape of the complete array
+        dataType (numpy data type): data type of the array
+    """
+    npyFormat.write_array_header_1_0(fid, {'descr': npyFormat.dtype_to_descr(np.dtype(dataType)),
+                                           'fortran_order': False,
+                                           'shape': shape})
+
+
+def exportFrames(spe, fname, frames=None, delimiter=None, memoryBudget=MEMORYBUDGET, **hdf5Options):
+    """Exports a selection of frames of a SPE file in one pass. The format is given by the extension of fname:
+        - .csv, .tsv, .txt, .dat: text file (see the description of the library), one file per region of interest
+          (with a '-r0', '-r1', etc. suffix) for multiple regions
+        - .npy: array (nb of selected frames, nb of pixels along y, nb of pixels along x), one file per region of interest
+        - .npz: arrays 'data' (or 'r0', 'r1', etc. for multiple regions of interest), 'wavelength' and 'frameIndices'
+        - .hdf5, .h5: see SPEhdf5.convertSPEtoHDF5() (needs h5py)
+
+    Args:
+        spe (str or SPE map object): path to the SPE file or opened file (SPE2map, SPE3map or SPEhdf5map)
+        fname (str): path to the exported file
+        frames (str or range, optional): frames to export, range or selection string (see parseFrameSelection()).
+                                         All frames if None.
+        delimiter (str, optional): delimiter of text files (depends on the extension if None)
+        memoryBudget (int, optional): memory allowed for a chunk of frames, in bytes
+        **hdf5Options: options passed to SPEhdf5.convertSPEtoHDF5() (compression, compressionLevel)
+
+    Returns:
+        list: paths of the exported files
+
+    Raises:
+        ValueError: if the extension of fname is not supported or the frame selection is invalid
+    """
+    baseName, extension = os.path.splitext(fname)
+    extension = extension.lower()
+    if extension not in DELIMITERS and extension not in BINARYEXTENSIONS:
+        raise ValueError('Unsupported export format {!r} (supported: {}).'.format(
+            extension, ', '.join(sorted(DELIMITERS) + list(BINARYEXTENSIONS))))
+    if type(spe) == str:
+        spe = openSPE(spe, memmap=True)
+    frameIndices = frames if type(frames) == range else parseFrameSelection(frames, spe.nbOfFrames)
+
+    if extension in ('.hdf5', '.h5'):
+        from tools.instruments.princeton3.SPEhdf5 import convertSPEtoHDF5
+        return [convertSPEtoHDF5(spe.fname, fname, start=frameIndices.start, stop=frameIndices.stop,
+                                 step=frameIndices.step, memoryBudget=memoryBudget, **hdf5Options)]
+
+    regions = spe.data if type(spe.data) == dict else {'': spe.data}
+    regionSizes = {name: tuple(region.shape[1:]) for name, region in regions.items()}
+    dataTypes = {name: region.dtype for name, region in regions.items()}
+    nbOfValuesPerFrame = sum(int(np.prod(size)) for size in regionSizes.values())
+    bytesPerValue = TEXTBYTESPERVALUE if extension in DELIMITERS else max(dataType.itemsize for dataType in dataTypes.values())
+    nbOfFramesPerChunk = max(1, int(memoryBudget // (nbOfValuesPerFrame * bytesPerValue)))
+
+    if extension == '.npz':  # one pass per region (only one file of the archive can be written at a time)
+        with zipfile.ZipFile(fname, 'w', allowZip64=True) as archive:
+            for name in regions:
+                with archive.open(name + '.npy' if name else 'data.npy', 'w', force_zip64=True) as fid:
+                    _writeNpyHeader(fid, (len(frameIndices),) + regionSizes[name], dataTypes[name])
+                    for _, chunk in _iterChunks(spe, frameIndices, nbOfFramesPerChunk):
+                        fid.write(np.ascontiguousarray(chunk[name]).tobytes())
+            for name, array in (('wavelength', spe.wavelength), ('frameIndices', frameIndices)):
+                with archive.open(name + '.npy', 'w') as fid:
+                    npyFormat.write_array(fid, np.asarray(array))
+        return [fname]
+
+    # .npy and text files: one file per region, all written in the same pass over the frames
+    fnames = {name: '{}-{}{}'.format(baseName, name, extension) if name else fname for name in regions}
+    if extension == '.npy':
+        fids = {name: open(fnames[name], 'wb') for name in regions}
+        for name, fid in fids.items():
+            _writeNpyHeader(fid, (len(frameIndices),) + regionSizes[name], dataTypes[name])
+    else:
+        delimiter = DELIMITERS[extension] if delimiter is None else delimiter
+        lineFormats = {name: _textLineFormat(regionSizes[name], dataTypes[name], delimiter) for name in regions}
+        fids = {name: open(fnames[name], 'w') for name in regions}
+        for name, fid in fids.items():
+            fid.write(_textHeader(spe.wavelength, regionSizes[name], delimiter))
+    try:
+        for chunkIndices, chunk in _iterChunks(spe, frameIndices, nbOfFramesPerChunk):
+            for name, fid in fids.items():
+                if extension == '.npy':
+                    fid.write(np.ascontiguousarray(chunk[name]).tobytes())
+                else:
+                    fid.write(_formatTextChunk(chunkIndices, chunk[name], lineFormats[name]))
+    finally:
+        for fid in fids.values():
+            fid.close()
+    return list(fnames.values())
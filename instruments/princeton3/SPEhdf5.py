@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+This library converts SPE files (SPE2 or SPE3) to compressed HDF5 files and reads them back
+with the same standardized interface as SPE2map and SPE3map.
+
+The HDF5 files follow the DataObjectHDF5 layout (see data_object.py): numbers and strings are stored
+as attributes of the root group and arrays as datasets. The frames are stored in the 'data' dataset
+(or 'data/r0', 'data/r1', etc. for multiple regions of interest), chunked frame by frame and compressed
+with the shuffle filter and gzip or lzf, so that reading a frame only decompresses this frame.
+
+IMPORTANT NOTE: needs the h5py package to work.
+
+This is a python 3 library.
+"""
+
+import h5py
+import os
+from tools.instruments.princeton3.SPEread import openSPE
+from tools.instruments.princeton3.SPEreduce import chunkLength, reduceFrames, REDUCTIONS, MEMORYBUDGET
+
+
+def convertSPEtoHDF5(speFname, hdf5Fname=None, compression='gzip', compressionLevel=4,
+                     start=0, stop=None, step=1, memoryBudget=MEMORYBUDGET):
+    """Converts a SPE file to a HDF5 file, streaming the frames in chunks (the SPE file is never loaded completely).
+
+    Args:
+        speFname (str): path to the SPE file
+        hdf5Fname (str, optional): path to the HDF5 file (SPE filename with a .hdf5 extension if None)
+        compression (str, optional): 'gzip' (smaller files), 'lzf' (faster) or None
+        compressionLevel (int, optional): gzip compression level (0 to 9)
+        start (int, optional): index of the first frame to convert
+        stop (int, optional): index after the last frame to convert (until the end of the file if None)
+        step (int, optional): step between the converted frames
+        memoryBudget (int, optional): memory allowed for a chunk of frames, in bytes
+
+    Returns:
+        str: path to the HDF5 file
+    """
+    if hdf5Fname is None:
+        hdf5Fname = os.path.splitext(speFname)[0] + '.hdf5'
+    spe = openSPE(speFname, memmap=True)
+    regions = spe.data if type(spe.data) == dict else {'': spe.data}
+    frameIndices = range(spe.nbOfFrames)[start:stop:step]
+
+    with h5py.File(hdf5Fname, 'w') as fileHandle:
+        fileHandle.attrs['sourceFile'] = os.path.abspath(speFname)
+        fileHandle.attrs['SPEversion'] = float(spe.SPEversion)
+        fileHandle.attrs['exposureTime'] = float(spe.exposureTime)
+        fileHandle.attrs['nbOfFrames'] = len(frameIndices)
+        for name in ('grating', 'center_wavelength', 'detTemperature'):
+            if getattr(spe, name, None) is not None:
+                fileHandle.attrs[name] = getattr(spe, name)
+        fileHandle.create_dataset('wavelength', data=spe.wavelength)
+
+        for name, frames in regions.items():
+            dataset = fileHandle.create_dataset('data/' + name if name else 'data',
+                                                shape=(len(frameIndices),) + frames.shape[1:],
+                                                dtype=frames.dtype,
+                                                chunks=(1,) + frames.shape[1:],
+                                                shuffle=compression is not None,
+                                                compression=compression,
+                                                compression_opts=compressionLevel if compression == 'gzip' else None)
+            nbOfFramesPerChunk = chunkLength(frames, memoryBudget)
+            for chunkStart in range(0, len(frameIndices), nbOfFramesPerChunk):
+                chunkIndices = frameIndices[chunkStart:chunkStart + nbOfFramesPerChunk]
+                dataset[chunkStart:chunkStart + len(chunkIndices)] = frames[chunkIndices.start:chunkIndices.stop:chunkIndices.step]
+    return hdf5Fname
+
+
+class SPEhdf5map:
+
+    """Class which reads the HDF5 files created by convertSPEtoHDF5(). The frames are read lazily from the file.
+
+    Reliable attributes (standardized interface): data, exposureTime, nbOfFrames, regionSize, SPEversion and wavelength.
+
+    Attributes:
+        data (h5py dataset): frames (nb of frames, nb of pixels along y, nb of pixels along x), read from the file
+                             when sliced (data[n] is a numpy array). Dictionary of datasets for multiple regions of interest.
+        exposureTime (float): exposure time of each frame (as in the SPE file)
+        fname (str): filename
+        nbOfFrames (int): number of frames recorded in the file
+        regionSize (tuple): size of a frame (nb of pixels along y, nb of pixels along x), list of sizes for multiple regions
+        SPEversion (float): SPE version of the original file
+        wavelength (numpy array): array of floats containing the wavelengths vector
+        grating (string): selected grating information (SPE3 files only)
+        center_wavelength: central wavelength for measurement (SPE3 files only)
+    """
+
+    def __init__(self, fname):
+        """Opens the HDF5 file and reads the metadata.
+
+        Parameters:
+            fname (str): Filename of the HDF5 file
+        """
+        self.fname = fname
+        self._fileHandle = h5py.File(fname, 'r')
+        for name, value in self._fileHandle.attrs.items():
+            setattr(self, name, value)
+        self.nbOfFrames = int(self.nbOfFrames)
+        self.wavelength = self._fileHandle['wavelength'][()]
+        if isinstance(self._fileHandle['data'], h5py.Dataset):
+            self.data = self._fileHandle['data']
+            self.regionSize = self.data.shape[1:]
+        else:
+            self.data = {name: self._fileHandle['data'][name] for name in sorted(self._fileHandle['data'], key=lambda name: int(name[1:]))}
+            self.regionSize = [region.shape[1:] for region in self.data.values()]
+
+    def close(self):
+        """Closes the HDF5 file."""
+        self._fileHandle.close()
+
+    def readFrames(self, start=0, stop=None, step=1, roi=None):
+        """Reads a range of frames, possibly restricted to a window of pixels. Only the requested frames are decompressed.
+
+        Args:
+            start (int, optional): index of the first frame
+            stop (int, optional): index after the last frame (until the end of the file if None)
+            step (int, optional): step between the frames
+            roi (tuple, optional): pixel window (y0, y1, x0, x1), same meaning as slice indices. All pixels if None.
+
+        Returns:
+            numpy array or dict: array of the frames (nb of frames, nb of pixels along y, nb of pixels along x).
+                                 For multiple regions of interest, dictionary of such arrays (same keys as data).
+        """
+        window = (slice(start, stop, step),)
+        if roi is not None:
+            window += (slice(roi[0], roi[1]), slice(roi[2], roi[3]))
+        if type(self.data) == dict:
+            return {name: region[window] for name, region in self.data.items()}
+        return self.data[window]
+
+    def reduceFrames(self, reductions=REDUCTIONS, reducer=None, memoryBudget=MEMORYBUDGET):
+        """Computes reductions over all the frames in one pass, reading the frames in chunks (see SPEreduce.reduceFrames()).
+
+        Args:
+            reductions (iterable, optional): reductions to compute among 'sum', 'mean', 'max', 'min' and 'var'
+            reducer (function, optional): user reduction called as accumulator = reducer(chunk, accumulator)
+            memoryBudget (int, optional): working memory allowed for a chunk of frames, in bytes
+
+        Returns:
+            dict: result of each reduction (frame-shaped arrays), the result of reducer is under 'reducer'.
+                  For multiple regions of interest, dictionary of such results (same keys as data).
+        """
+        if type(self.data) == dict:
+            return {name: reduceFrames(region, reductions, reducer, memoryBudget) for name, region in self.data.items()}
+        return reduceFrames(self.data, reductions, reducer, memoryBudget)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+This library opens SPE files of any version (WinSpec SPE2 or LightField SPE3) with the right reader.
+The version number is read once and the file handle is shared with the reader.
+
+All the readers share the same standardized interface: data, exposureTime, nbOfFrames, regionSize, SPEversion,
+wavelength, readFrames() and reduceFrames().
+HDF5 files converted from SPE files (see SPEhdf5.convertSPEtoHDF5()) are opened as well.
+
+This is a python 3 library.
+"""
+
+import numpy as np
+from tools.instruments.princeton3.SPE2read import SPE2map
+from tools.instruments.princeton3.SPE3read import SPE3map
+
+HDF5SIGNATURE = b'\x89HDF\r\n\x1a\n'  # first bytes of a HDF5 file
+
+
+def readSPEversion(fid):
+    """Reads the SPE version of a file (always there in SPE 2.x or 3.0 files).
+
+    Args:
+        fid (file): file object of the SPE file opened in binary mode
+
+    Returns:
+        float: SPE version of the file
+    """
+    fid.seek(SPE3map.SPEVERSIONOFFSET)
+    version = np.fromfile(fid, np.float32, 1)
+    if len(version) == 0:
+        raise ValueError('{} is too short to be a SPE file.'.format(getattr(fid, 'name', 'File')))
+    return float(version[0])
+
+
+def openSPE(fname, memmap=True, headerOnly=False):
+    """Opens a SPE file as an SPE3map (version 3 and above) or an SPE2map (older versions).
+    By default, the data is memory mapped so that only the metadata is read when opening the file.
+    A HDF5 file converted from a SPE file is opened as an SPEhdf5map (its data is always read lazily).
+
+    Args:
+        fname (str): path to the SPE file
+        memmap (bool, optional): if True, data is read-only memory mapped (frames read from disk only when used)
+        headerOnly (bool, optional): if True, only the metadata is read and data is None
+
+    Returns:
+        SPE3map, SPE2map or SPEhdf5map object: object to handle the file (access to wavelength vector, different frames, etc.)
+    """
+    fid = open(fname, 'rb')
+    try:
+        if fid.read(len(HDF5SIGNATURE)) == HDF5SIGNATURE:
+            fid.close()
+            from tools.instruments.princeton3.SPEhdf5 import SPEhdf5map
+            return SPEhdf5map(fname)
+        version = readSPEversion(fid)
+        if version >= 3:
+            return SPE3map(fid=fid, memmap=memmap, headerOnly=headerOnly, SPEversion=version)
+        return SPE2map(fid=fid, memmap=memmap, headerOnly=headerOnly)  # the version is part of the SPE2 header
+    except:
+        fid.close()
+        raise
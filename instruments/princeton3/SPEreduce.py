@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+This library computes reductions (sum, mean, max, min, variance) over the frames of SPE files
+by streaming the frames in chunks, so that the frames never need to be in memory all at once.
+It is used by the SPE2read and SPE3read libraries (see their reduceFrames() methods).
+
+This is a python 3 library.
+"""
+
+import numpy as np
+
+MEMORYBUDGET = 256 * 2**20  # default working memory in bytes allowed for a chunk of frames
+REDUCTIONS = ('sum', 'mean', 'max', 'min', 'var')
+
+
+def chunkLength(frames, memoryBudget=MEMORYBUDGET):
+    """Determines the number of frames in a chunk so that the working memory stays within memoryBudget.
+    The working memory is estimated as the raw chunk plus two float64 copies of it (needed for the variance).
+
+    Args:
+        frames (numpy array): frames (first axis) to process
+        memoryBudget (int, optional): working memory allowed, in bytes
+
+    Returns:
+        int: number of frames per chunk (at least 1)
+    """
+    frameNbytes = int(np.prod(frames.shape[1:])) * (frames.dtype.itemsize + 2 * 8)
+    return max(1, int(memoryBudget // frameNbytes))
+
+
+def reduceFrames(frames, reductions=REDUCTIONS, reducer=None, memoryBudget=MEMORYBUDGET):
+    """Computes reductions over the frames (first axis) in one pass, reading the frames chunk by chunk.
+    The variance is computed by merging the mean and sum of squared deviations of each chunk
+    (Welford / Chan et al. algorithm), which is numerically stable.
+
+    Args:
+        frames (numpy array): frames to reduce, typically a memory map of the file (nb of frames, ...)
+        reductions (iterable, optional): reductions to compute among 'sum', 'mean', 'max', 'min' and 'var' (population variance)
+        reducer (function, optional): user reduction called as accumulator = reducer(chunk, accumulator) for each
+                                      chunk of frames (accumulator is None for the first chunk)
+        memoryBudget (int, optional): working memory allowed for a chunk, in bytes (determines the chunk size)
+
+    Returns:
+        dict: result of each reduction (arrays with the shape of a frame), the result of reducer is under 'reducer'
+
+    Raises:
+        ValueError: if a reduction is unknown or if there is no frame
+    """
+    if len(frames) == 0:
+        raise ValueError('No frame to reduce')
+    unknownReductions = set(reductions) - set(REDUCTIONS)
+    if unknownReductions:
+        raise ValueError('Unknown reductions: {}'.format(', '.join(sorted(unknownReductions))))
+
+    results = {}
+    count = 0
+    mean = m2 = accumulator = None
+    step = chunkLength(frames, memoryBudget)
+    for chunkStart in range(0, len(frames), step):
+        chunk = np.asarray(frames[chunkStart:chunkStart + step])
+
+        if 'sum' in reductions:
+            chunkSum = chunk.sum(0)
+            results['sum'] = chunkSum if 'sum' not in results else results['sum'] + chunkSum
+        if 'max' in reductions:
+            chunkMax = chunk.max(0)
+            results['max'] = chunkMax if 'max' not in results else np.maximum(results['max'], chunkMax)
+        if 'min' in reductions:
+            chunkMin = chunk.min(0)
+            results['min'] = chunkMin if 'min' not in results else np.minimum(results['min'], chunkMin)
+        if 'mean' in reductions or 'var' in reductions:
+            chunk64 = chunk.astype(np.float64)
+            chunkMean = chunk64.mean(0)
+            chunkM2 = ((chunk64 - chunkMean)**2).sum(0)
+            if mean is None:
+                mean, m2 = chunkMean, chunkM2
+            else:
+                delta = chunkMean - mean
+                newCount = count + len(chunk)
+                mean = mean + delta * (len(chunk) / newCount)
+                m2 = m2 + chunkM2 + delta**2 * (count * len(chunk) / newCount)
+        if reducer is not None:
+            accumulator = reducer(chunk, accumulator)
+        count += len(chunk)
+
+    if 'mean' in reductions:
+        results['mean'] = mean
+    if 'var' in reductions:
+        results['var'] = m2 / count
+    if reducer is not None:
+        results['reducer'] = accumulator
+    return results
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+This library writes synthetic SPE files which can be read back by the SPE2read and SPE3read libraries.
+Useful to generate test data and benchmarks without a spectrometer at hand.
+
+This is a python 3 library.
+"""
+
+import pylab as pl
+import time
+from tools.instruments.princeton3.SPE2read import SPE2file
+from tools.instruments.princeton3.SPE3read import SPE3map
+
+
+def writeSPE2file(fname, data, exposureTime=1000., wavelengthCoeffs=(0., 1.), detTemperature=-70., fileDate=None):
+    """Writes a SPE2 (WinSpec) file containing data.
+
+    Args:
+        fname (str): path to the file to write
+        data (numpy array): frames to save (3D array: nb of frames, nb of pixels along y, nb of pixels along x).
+                            Its data type should be one of float32, int32, int16 or uint16.
+        exposureTime (float, optional): exposure time of each frame, in the units of SPE2map.exposureTime
+        wavelengthCoeffs (tuple, optional): polynomial calibration coefficients (lowest order first, up to 6)
+        detTemperature (float, optional): detector temperature
+        fileDate (time.struct_time, optional): date of the measurement (now if None)
+    """
+    data = pl.asarray(data)
+    dataTypes = (pl.float32, pl.int32, pl.int16, pl.uint16)
+    dataTypeNb = [pl.dtype(dataType) for dataType in dataTypes].index(data.dtype)
+    if fileDate is None:
+        fileDate = time.localtime()
+
+    header = pl.zeros(1, SPE2file.HEADERDTYPE)
+    header['Exposure'] = exposureTime / 1000.
+    header['DetTemperature'] = detTemperature
+    header['date'] = time.strftime('%d%b%Y', fileDate).encode('ascii')
+    header['ExperimentTimeLocal'] = time.strftime('%H%M%S', fileDate).encode('ascii')
+    header['datatype'] = dataTypeNb
+    header['NumFrames'], header['ydim'], header['xdim'] = data.shape
+    header['yDimDet'], header['xDimDet'] = data.shape[1:]
+    header['SPEversion'] = 2.5
+    header['polynom_coeff_x'][0, :len(wavelengthCoeffs)] = wavelengthCoeffs
+
+    with open(fname, 'wb') as fid:
+        header.tofile(fid)
+        pl.ascontiguousarray(data, dtype=data.dtype.newbyteorder('<')).tofile(fid)
+
+
+class SPE3writer:
+    """Writes a SPE3 (LightField) file frame by frame, the way LightField does during an acquisition:
+    the header is written first with a null XML footer offset, the frames are appended as they come 
+    and the XML footer is written when the file is closed. Useful to simulate an acquisition (see SPE3follower).
+
+    Attributes:
+        dataType (numpy data type): data type of the pixels (uint16, uint32 or float32)
+        fname (str): filename
+        frameStride (int): step in bytes from one frame to the next (frame and its metadata)
+        METADATATYPE (numpy dtype): data type of the metadata recorded after each frame if recordMetadata is True
+        nbOfFrames (int): number of frames written so far
+        recordMetadata (bool): if True, exposure time stamps and frame tracking number are recorded after each frame
+        regionSize (tuple): size of a frame (nb of pixels along y, nb of pixels along x)
+        TIMESTAMPRESOLUTION (int): number of time stamp ticks per second
+    """
+
+    PIXELFORMATS = {pl.dtype(pl.uint16): ('MonochromeUnsigned16', 3),
+                    pl.dtype(pl.uint32): ('MonochromeUnsigned32', 8),
+                    pl.dtype(pl.float32): ('MonochromeFloating32', 0)}  # data type: (pixel format, legacy data type)
+    METADATATYPE = pl.dtype([('ExposureStarted', '<i8'), ('ExposureEnded', '<i8'), ('FrameTrackingNumber', '<i8')])
+    TIMESTAMPRESOLUTION = 1000000
+
+    def __init__(self, fname, regionSize, dataType=pl.uint16, wavelength=None, exposureTime=1000.,
+                 grating='[500nm,1200][1][0]', centerWavelength=935., detTemperature=-70., recordMetadata=False):
+        """Creates the file and writes the header.
+
+        Args:
+            fname (str): path to the file to write
+            regionSize (tuple): size of a frame (nb of pixels along y, nb of pixels along x)
+            dataType (numpy data type, optional): data type of the pixels (uint16, uint32 or float32)
+            wavelength (numpy array, optional): wavelength calibration (pixel indices if None)
+            exposureTime (float, optional): exposure time of each frame (same units as SPE3map.exposureTime)
+            grating (str, optional): selected grating information
+            centerWavelength (float, optional): central wavelength of the spectrometer
+            detTemperature (float, optional): detector temperature set point
+            recordMetadata (bool, optional): if True, records time stamps and frame tracking number after each frame
+        """
+        self.fname = fname
+        self.regionSize = tuple(regionSize)
+        self.dataType = pl.dtype(dataType).newbyteorder('<')
+        self.wavelength = pl.arange(self.regionSize[1]) if wavelength is None else pl.asarray(wavelength)
+        self.exposureTime = exposureTime
+        self.grating = grating
+        self.centerWavelength = centerWavelength
+        self.detTemperature = detTemperature
+        self.recordMetadata = recordMetadata
+        self.nbOfFrames = 0
+        self.frameStride = int(pl.prod(self.regionSize)) * self.dataType.itemsize
+        if recordMetadata:
+            self.frameStride += self.METADATATYPE.itemsize
+
+        header = pl.zeros(1, SPE2file.HEADERDTYPE)
+        header['ydim'], header['xdim'] = self.regionSize
+        header['datatype'] = self.PIXELFORMATS[pl.dtype(dataType)][1]
+        header['SPEversion'] = 3.0
+        self._fid = open(fname, 'wb')
+        header.tofile(self._fid)
+        self._fid.flush()
+
+    def writeFrames(self, frames, exposureStarted=None, frameTrackingNumbers=None):
+        """Appends frames to the file.
+
+        Args:
+            frames (numpy array): frames to write (nb of frames, nb of pixels along y, nb of pixels along x)
+            exposureStarted (numpy array, optional): exposure start time of each frame in seconds, used if recordMetadata
+                                                     (frames taken one after the other from 0 if None)
+            frameTrackingNumbers (numpy array, optional): frame tracking number of each frame, used if recordMetadata
+                                                          (frames numbered from 1 if None)
+        """
+        frames = pl.asarray(frames, dtype=self.dataType).reshape((-1,) + self.regionSize)
+        if self.recordMetadata:
+            frameIndices = pl.arange(self.nbOfFrames, self.nbOfFrames + len(frames))
+            if exposureStarted is None:
+                exposureStarted = frameIndices * self.exposureTime / 1000.
+            if frameTrackingNumbers is None:
+                frameTrackingNumbers = frameIndices + 1
+            records = pl.zeros(len(frames), dtype=[('frame', self.dataType, self.regionSize)] + self.METADATATYPE.descr)
+            records['frame'] = frames
+            records['ExposureStarted'] = pl.around(pl.asarray(exposureStarted) * self.TIMESTAMPRESOLUTION)
+            records['ExposureEnded'] = records['ExposureStarted'] + round(self.exposureTime / 1000. * self.TIMESTAMPRESOLUTION)
+            records['FrameTrackingNumber'] = frameTrackingNumbers
+            frames = records
+        frames.tofile(self._fid)
+        self._fid.flush()
+        self.nbOfFrames += len(frames)
+
+    def close(self):
+        """Writes the XML footer and its offset in the header, then closes the file."""
+        frameSize = int(pl.prod(self.regionSize)) * self.dataType.itemsize
+        metaFormat = ''
+        if self.recordMetadata:
+            metaFormat = ('<MetaFormat><MetaBlock type="Frame">'
+                          '<TimeStamp event="ExposureStarted" type="Int64" bitDepth="64" resolution="{resolution}"/>'
+                          '<TimeStamp event="ExposureEnded" type="Int64" bitDepth="64" resolution="{resolution}"/>'
+                          '<FrameTrackingNumber type="Int64" bitDepth="64"/>'
+                          '</MetaBlock></MetaFormat>').format(resolution=self.TIMESTAMPRESOLUTION)
+        footer = ('<?xml version="1.0" encoding="utf-8"?>'
+                  '<SpeFormat version="3.0" xmlns="http://www.princetoninstruments.com/spe/2009">'
+                  '<DataFormat>'
+                  '<DataBlock type="Frame" version="1" count="{nbOfFrames}" pixelFormat="{pixelFormat}" size="{frameSize}" stride="{frameStride}">'
+                  '<DataBlock type="Region" count="1" width="{width}" height="{height}" size="{frameSize}" stride="{frameSize}"/>'
+                  '</DataBlock>'
+                  '</DataFormat>'
+                  '{metaFormat}'
+                  '<Calibrations><WavelengthMapping id="1"><Wavelength xml:space="preserve">{wavelength}</Wavelength></WavelengthMapping></Calibrations>'
+                  '<DataHistories><DataHistory><Origin><Experiment><Devices>'
+                  '<Cameras><Camera>'
+                  '<Sensor><Temperature><SetPoint type="Double">{detTemperature}</SetPoint></Temperature></Sensor>'
+                  '<ShutterTiming><ExposureTime type="Double">{exposureTime}</ExposureTime></ShutterTiming>'
+                  '</Camera></Cameras>'
+                  '<Spectrometers><Spectrometer><Grating>'
+                  '<Selected type="String">{grating}</Selected><CenterWavelength type="Double">{centerWavelength}</CenterWavelength>'
+                  '</Grating></Spectrometer></Spectrometers>'
+                  '</Devices></Experiment></Origin></DataHistory></DataHistories>'
+                  '</SpeFormat>').format(nbOfFrames=self.nbOfFrames,
+                                         pixelFormat=self.PIXELFORMATS[self.dataType.newbyteorder('=')][0],
+                                         frameSize=frameSize,
+                                         frameStride=self.frameStride,
+                                         metaFormat=metaFormat,
+                                         height=self.regionSize[0],
+                                         width=self.regionSize[1],
+                                         wavelength=','.join(repr(float(w)) for w in self.wavelength),
+                                         detTemperature=self.detTemperature,
+                                         exposureTime=self.exposureTime,
+                                         grating=self.grating,
+                                         centerWavelength=self.centerWavelength)
+        footerPos = self._fid.tell()
+        self._fid.write(footer.encode('utf-8'))
+        self._fid.seek(SPE3map.XMLFOOTEROFFSETPOS)
+        pl.array(footerPos, dtype='<u8').tofile(self._fid)
+        self._fid.seek(SPE2file.HEADERDTYPE.fields['NumFrames'][1])
+        pl.array(self.nbOfFrames, dtype='<u4').tofile(self._fid)
+        self._fid.close()
+
+
+def writeSPE3file(fname, data, **options):
+    """Writes a SPE3 (LightField) file containing data (one region of interest).
+
+    Args:
+        fname (str): path to the file to write
+        data (numpy array): frames to save (3D array: nb of frames, nb of pixels along y, nb of pixels along x).
+                            Its data type should be one of uint16, uint32 or float32.
+        **options: other options passed to SPE3writer (wavelength, exposureTime, grating, centerWavelength, detTemperature)
+    """
+    data = pl.asarray(data)
+    writer = SPE3writer(fname, data.shape[1:], dataType=data.dtype, **options)
+    writer.writeFrames(data)
+    writer.close()
+
+
+def simulateAcquisition(fname, data, frameInterval=0.1, **options):
+    """Simulates a LightField acquisition: writes data to a SPE3 file one frame every frameInterval seconds, 
+    then writes the footer. Run it in a thread or another process to test a reader following the file.
+
+    Args:
+        fname (str): path to the file to write
+        data (numpy array): frames to write (3D array: nb of frames, nb of pixels along y, nb of pixels along x)
+        frameInterval (float, optional): time between two frames in seconds
+        **options: other options passed to SPE3writer
+    """
+    data = pl.asarray(data)
+    writer = SPE3writer(fname, data.shape[1:], dataType=data.dtype, **options)
+    for frame in data:
+        time.sleep(frameInterval)
+        writer.writeFrames(frame)
+    writer.close()
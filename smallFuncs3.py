@@ -7,10 +7,10 @@ Created on Thu Jun 23 11:06:12 2016
 
 Small functions used a bit everywhere!
 
-/!\ Python 3 / PyQt 5 version
+/!\ Python 3 / PyQt 5 version (PyQt 5 is only imported by the functions displaying windows)
 """
 
-from PyQt5.QtWidgets import QMessageBox
+import numpy as np
 
 def cacheName(filename):
     """Simple function to obtain cache files name. 
@@ -60,18 +60,106 @@ def increasingTuples(listOfTuples):
             return False
     return True
 
+def sortOrder(array):
+    """
+    Detects whether a 1D array is sorted (e.g. SPE wavelength vector, voltage sweep)
+    
+    Args:
+        array (numpy array): 1D array of numbers
+    
+    Returns:
+        int: 1 if sorted in increasing order (non-decreasing), -1 if sorted in decreasing order (non-increasing), 0 otherwise.
+    """
+    steps = np.diff(array)
+    if np.all(steps >= 0):
+        return 1
+    if np.all(steps <= 0):
+        return -1
+    return 0
+
+class NearestIndexFinder:
+    """
+    Finds the indices of the nearest elements of an axis (1D array) for whole arrays of values at once.
+    Sorted axes (increasing or decreasing, detected once) are searched by bisection with np.searchsorted 
+    (O(log n) per value), other axes with abs(value - axis).argmin() (O(n) per value).
+    Same result as argmin in all cases: ties give the first index.
+    Arrays with several dimensions are searched as flattened arrays (flat index, like argmin).
+    
+    Example:
+        finder = NearestIndexFinder(spe.wavelength)
+        peakPixels = finder.nearest(peakWavelengths)
+    
+    Attributes:
+        axis (numpy array): array to search
+        sortOrder (int): 1 (increasing), -1 (decreasing) or 0 (not sorted), see sortOrder()
+    """
+    
+    def __init__(self, axis):
+        """
+        Args:
+            axis (numpy array or list): 1D array of numbers to search (flattened if several dimensions, never considered sorted)
+        """
+        self.axis = np.asarray(axis)
+        if self.axis.ndim != 1:
+            self.axis = self.axis.ravel()
+            self.sortOrder = 0
+        else:
+            self.sortOrder = sortOrder(self.axis) if self.axis.size > 1 else 1
+        # the bisection is done on an increasing array: reversed decreasing axis
+        self._sortedAxis = self.axis[::-1] if self.sortOrder == -1 else self.axis
+    
+    def nearest(self, values):
+        """
+        Finds the indices of the elements of the axis closest to values
+        
+        Args:
+            values (number or numpy array): value(s) to search in the axis
+        
+        Returns:
+            int or numpy array: index (or array of indices, same shape as values) of the elements closest to values
+        """
+        values = np.asarray(values)
+        if self.sortOrder == 0:
+            indices = np.abs(self.axis - values[..., np.newaxis]).argmin(axis=-1)
+        else:
+            indices = self._nearestSorted(values)
+        return int(indices) if indices.ndim == 0 else indices
+    
+    def _nearestSorted(self, values):
+        """Bisection search in the increasing array _sortedAxis, returns indices in axis (first index for ties)."""
+        sortedAxis = self._sortedAxis
+        right = np.clip(np.searchsorted(sortedAxis, values, side='left'), 1, len(sortedAxis) - 1)
+        left = right - 1
+        leftDistance, rightDistance = np.abs(values - sortedAxis[left]), np.abs(sortedAxis[right] - values)
+        if self.sortOrder == 1:
+            # left element on ties, first occurrence of repeated values
+            indices = np.where(leftDistance <= rightDistance, left, right)
+            indices = np.searchsorted(sortedAxis, sortedAxis[indices], side='left')
+        else:
+            # reversed axis: right element on ties, last occurrence of repeated values (first ones in axis)
+            indices = np.where(rightDistance <= leftDistance, right, left)
+            indices = len(sortedAxis) - np.searchsorted(sortedAxis, sortedAxis[indices], side='right')
+        if len(sortedAxis) == 1:
+            indices = np.zeros_like(indices)
+        indices = np.where(np.isnan(values), 0, indices) if np.issubdtype(values.dtype, np.floating) else indices
+        return indices
+
 def argNearest(arrayToSearch, value):
     """
     Find the index of the nearest value in an array
+    (arrays of values are searched by bisection in sorted arrays, see NearestIndexFinder; use it directly to search
+    the same array several times)
     
     Args:
-        arrayToSearch (numpy array): array of numbers
-        value (number): value to search in array
+        arrayToSearch (numpy array): array of numbers (flat index for several dimensions, like argmin)
+        value (number or numpy array): value(s) to search in array
     
     Returns:
-        int: index of element closest to value in arrayToSearch.
+        int: index of element closest to value in arrayToSearch (array of indices if value is an array).
     """
-    return (abs(value - arrayToSearch)).argmin()
+    if np.ndim(value) == 0:
+        return (abs(value - np.asarray(arrayToSearch))).argmin()  # a single value: one pass, cheaper than sorting
+    return NearestIndexFinder(arrayToSearch).nearest(value)
     
 def errorMessageWindow(parentWindow, winTitle, winText):
     """
@@ -82,6 +170,7 @@ def errorMessageWindow(parentWindow, winTitle, winText):
         winTitle (str): Text displayed as error window title
         winText (str): Text displayed as error message.
     """
+    from PyQt5.QtWidgets import QMessageBox
     msg = QMessageBox(parentWindow)
     msg.setIcon(QMessageBox.Critical)
     msg.setWindowTitle(winTitle)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 2026
+
+Regression tests of SPEcatalog (run with pytest, with the tools package importable).
+
+This is a python 3 library.
+"""
+
+import os
+import numpy as np
+from tools.instruments.princeton3.SPEcatalog import SPEcatalog
+from tools.instruments.princeton3.SPEwrite import writeSPE3file
+
+
+def _writeSpectrum(fname):
+    """Writes a small synthetic SPE3 file (2 frames of 10 pixels)."""
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    writeSPE3file(fname, np.zeros((2, 1, 10), dtype=np.uint16))
+
+
+def testUpdateOnlyRemovesFilesOfTheRootFolder(tmp_path):
+    """Rescanning a root folder whose name contains SQL wildcards (_, %) or differs only by case from another
+    catalogued folder must not remove the files of the other folder."""
+    for folder in ('bayX3', 'bay_3', 'BAY_3', 'bay%3'):
+        _writeSpectrum(str(tmp_path / folder / 'b.spe'))
+    catalog = SPEcatalog(str(tmp_path / 'catalog.sqlite'))
+    try:
+        assert catalog.update(str(tmp_path / 'bayX3')) == (1, 0)
+        assert catalog.update(str(tmp_path / 'BAY_3')) == (1, 0)
+        assert catalog.update(str(tmp_path / 'bay_3')) == (1, 0)
+        assert catalog.update(str(tmp_path / 'bay%3')) == (1, 0)
+        assert catalog.update(str(tmp_path / 'bay_3')) == (0, 0)
+        paths = [row['path'] for row in catalog.query()]
+        assert paths == sorted(str(tmp_path / folder / 'b.spe') for folder in ('BAY_3', 'bayX3', 'bay%3', 'bay_3'))
+    finally:
+        catalog.close()
+
+
+def testUpdateRemovesMissingFiles(tmp_path):
+    """Files deleted from the root folder are removed from the catalog."""
+    for name in ('a.spe', 'b.spe'):
+        _writeSpectrum(str(tmp_path / 'bay_3' / name))
+    catalog = SPEcatalog(str(tmp_path / 'catalog.sqlite'))
+    try:
+        assert catalog.update(str(tmp_path / 'bay_3')) == (2, 0)
+        os.remove(str(tmp_path / 'bay_3' / 'a.spe'))
+        assert catalog.update(str(tmp_path / 'bay_3')) == (0, 1)
+        assert [row['path'] for row in catalog.query()] == [str(tmp_path / 'bay_3' / 'b.spe')]
+    finally:
+        catalog.close()
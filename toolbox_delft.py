@@ -8,6 +8,7 @@ import platform
 import os
 import time
 import datetime
+from tools.smallFuncs3 import NearestIndexFinder
 
 try:
     import qt
@@ -54,9 +55,12 @@ except:
 
 def nearest_idx(array, value):
     '''
-    find the index of the value closest to the specified value.
+    find the index of the value closest to the specified value
+    (value can be an array of values, searched by bisection in sorted arrays, see smallFuncs3.NearestIndexFinder).
     '''
-    return np.abs(array-value).argmin()
+    if np.ndim(value) == 0:
+        return np.abs(np.asarray(array)-value).argmin()
+    return NearestIndexFinder(array).nearest(value)
 
 def nearest_value(array, value):
     '''